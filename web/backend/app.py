@@ -2,9 +2,11 @@
 TrackWise Web — FastAPI backend.
 
 Endpoints:
-  POST /api/search          — upload GPX + config, start background job
+  POST /api/search          — upload GPX + config, start (or join) a background job
   GET  /api/search/{job_id}/stream — SSE progress stream
   GET  /api/search/{job_id}/results — JSON results
+  POST /api/search/{job_id}/refine — re-run a finished search with a changed config
+  POST /api/search/{job_id}/routes — detour road geometry for given places (on demand)
   POST /api/export/gpx      — export GPX for selected places
   GET  /health              — health check
   GET  /                    — serve frontend index.html
@@ -22,7 +24,7 @@ import threading
 import time
 import uuid
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Set, Tuple
 
 from fastapi import Depends, FastAPI, File, Form, HTTPException, Request, UploadFile
 from fastapi.responses import (
@@ -37,9 +39,13 @@ from fastapi.staticfiles import StaticFiles
 from core.gpx_parser import parse_gpx
 from core.gpx_writer import build_enhanced_track_gpx, build_track_with_waypoints_gpx, build_waypoints_only_gpx
 from core.osrm import get_road_route_multi
+from core.overpass import SCHEDULER
+from core.query_planner import COST_MODEL
+from core.result_store import result_key, stats as result_store_stats
+from core.routing_cache import ROUTING_CACHE
 from core.valhalla import get_valhalla_route
 from core.place_types import PLACE_TYPE_CONFIG
-from core.search import SearchConfig, run_search
+from core.search import SearchConfig, fetch_road_routes, run_search
 
 # ---------------------------------------------------------------------------
 # Logging
@@ -94,6 +100,7 @@ class StatsTracker:
             "completed_searches": 0,
             "cancelled_searches": 0,
             "failed_searches": 0,
+            "coalesced_searches": 0,
             "total_waypoints_found": 0,
             "gpx_exports": 0,
             "recent_searches": [],
@@ -135,6 +142,12 @@ class StatsTracker:
             self._push_entry(self._new_entry(job_id, filename, "running"))
             self._save()
 
+    def record_search_coalesced(self, job_id: str):
+        """A submission identical to a running search joined that job instead of starting one."""
+        with self._lock:
+            self._data["coalesced_searches"] += 1
+            self._save()
+
     def record_upload_failed(self, filename: str, error: str):
         """Record a failure that happened before a job was created (e.g. GPX parse error)."""
         with self._lock:
@@ -196,6 +209,10 @@ class StatsTracker:
                 "uptime": f"{h}h {m}m {s}s",
                 "started_at": time.strftime("%Y-%m-%d %H:%M", time.localtime(self._started_at)),
                 "active_jobs": sum(1 for j in JOBS.values() if j.status == "running"),
+                "overpass_mirrors": SCHEDULER.health(),
+                "query_costs": COST_MODEL.snapshot(),
+                "result_store": result_store_stats(),
+                "routing_cache": ROUTING_CACHE.stats(),
             }
 
 
@@ -210,13 +227,20 @@ if (FRONTEND_DIR / "static").exists():
 # ---------------------------------------------------------------------------
 
 class SearchJob:
-    def __init__(self, job_id: str):
+    def __init__(self, job_id: str, search_key: str = ""):
         self.job_id = job_id
+        self.search_key = search_key
         self.status: str = "pending"  # pending | running | done | error | cancelled
         self.events: List[dict] = []
         self.result: Optional[dict] = None
         self.cancel_flag: bool = False
         self.created_at: float = time.time()
+        self.subscribers: Set[str] = set()  # one token per submission sharing this job
+        # Inputs, kept so a finished search can be refined without a new upload
+        self.route_points: list = []
+        self.gpx_obj = None
+        self.search_config: Optional[SearchConfig] = None
+        self.filename: str = ""
         self._lock = threading.Lock()
 
     def add_event(self, event: dict):
@@ -227,6 +251,38 @@ class SearchJob:
         with self._lock:
             return self.events[index:]
 
+    def attach(self) -> str:
+        """Register one more submission interested in this job; returns its token."""
+        token = uuid.uuid4().hex
+        with self._lock:
+            self.subscribers.add(token)
+        return token
+
+    def detach(self, token: Optional[str]):
+        """
+        Drop a submission's interest; the job is cancelled once nobody is left.
+        Without a token (older clients) the job is cancelled outright.
+        """
+        with self._lock:
+            if token is not None:
+                self.subscribers.discard(token)
+            remaining = len(self.subscribers) if token is not None else 0
+        if remaining == 0:
+            self.cancel()
+
+    def road_routes(self, place_ids: List[str]) -> Tuple[Dict[str, list], List[dict]]:
+        """(detour geometry loaded for place_ids, the result's places among them without)."""
+        with self._lock:
+            loaded = self.result["road_routes"]
+            wanted = set(place_ids)
+            known = {pid: loaded[pid] for pid in place_ids if pid in loaded}
+            missing = [p for p in self.result["places"] if p["id"] in wanted and p["id"] not in loaded]
+        return known, missing
+
+    def add_road_routes(self, routes: Dict[str, list]):
+        with self._lock:
+            self.result["road_routes"].update(routes)
+
     def cancel(self):
         self.cancel_flag = True
 
@@ -237,6 +293,10 @@ class SearchJob:
 JOBS: Dict[str, SearchJob] = {}
 JOB_TTL = 3600  # 1 hour
 
+# Identical searches still running, search key → job_id; later submissions join them
+INFLIGHT: Dict[str, str] = {}
+_INFLIGHT_LOCK = threading.Lock()
+
 
 def _cleanup_old_jobs():
     """Remove jobs older than TTL."""
@@ -247,21 +307,35 @@ def _cleanup_old_jobs():
         logger.info(f"Cleaned up job {jid}")
 
 
+def _join_inflight(search_key: str) -> Optional[SearchJob]:
+    """Return the running job for an identical search, if there is one to join."""
+    job_id = INFLIGHT.get(search_key)
+    job = JOBS.get(job_id) if job_id else None
+    if job is None or job.status not in ("pending", "running") or job.is_cancelled():
+        return None
+    return job
+
+
 # ---------------------------------------------------------------------------
 # Background search worker
 # ---------------------------------------------------------------------------
 
-def _run_search_worker(job: SearchJob, route_points, gpx_obj, search_config):
+def _run_search_worker(job: SearchJob, route_points, gpx_obj, search_config, prior: Optional[SearchJob] = None):
     job.status = "running"
+    prior_kwargs = {"prior_config": prior.search_config, "prior_result": prior.result} if prior else {}
     try:
-        for event in run_search(route_points, search_config, cancel_check=job.is_cancelled):
+        for event in run_search(
+            route_points, search_config, cancel_check=job.is_cancelled, job_id=job.job_id, **prior_kwargs,
+        ):
             job.add_event(event)
             if event["type"] == "result":
                 job.result = {
                     "places": event["places"],
-                    "road_routes": event["road_routes"],
+                    "road_routes": _carried_road_routes(prior, event["places"]) if prior else {},
                     "route_points": event["route_points"],
                     "total_km": event["total_km"],
+                    "gaps_km": event.get("gaps_km", []),  # a refine re-queries these
+                    "fetched_at": event["fetched_at"],  # a refine is as old as its oldest POI data
                     "gpx_obj": gpx_obj,  # kept for GPX export
                 }
                 job.status = "done"
@@ -279,6 +353,74 @@ def _run_search_worker(job: SearchJob, route_points, gpx_obj, search_config):
         job.add_event({"type": "error", "message": str(e)})
         job.status = "error"
         STATS.record_search_failed(job.job_id, str(e))
+    finally:
+        with _INFLIGHT_LOCK:
+            if INFLIGHT.get(job.search_key) == job.job_id:
+                del INFLIGHT[job.search_key]
+
+
+def _carried_road_routes(prior: SearchJob, places: List[dict]) -> Dict[str, list]:
+    """Detour geometry the refined job already fetched, re-keyed to the new place ids."""
+    by_location = {
+        (p["place_type"], p["lat"], p["lon"]): prior.result["road_routes"][p["id"]]
+        for p in prior.result["places"] if p["id"] in prior.result["road_routes"]
+    }
+    return {
+        p["id"]: by_location[(p["place_type"], p["lat"], p["lon"])]
+        for p in places if (p["place_type"], p["lat"], p["lon"]) in by_location
+    }
+
+
+def _ensure_road_routes(job: SearchJob, place_ids: List[str]) -> Dict[str, list]:
+    """Fetch (once per job) and return the detour geometry of the given places."""
+    known, missing = job.road_routes(place_ids)
+    if missing:
+        fetched = fetch_road_routes(job.result["route_points"], missing)
+        job.add_road_routes(fetched)
+        known.update(fetched)
+    return known
+
+
+def _parse_config(place_types_raw: dict) -> SearchConfig:
+    """{place_type: distance_km} → SearchConfig, dropping types with distance 0."""
+    return SearchConfig({pt: float(dist) for pt, dist in place_types_raw.items() if float(dist) > 0})
+
+
+def _launch_search(
+    route_points, gpx_obj, search_config: SearchConfig, filename: str, prior: Optional[SearchJob] = None,
+) -> dict:
+    """Join an identical running search or start a new job; returns the API response."""
+    # Same key as the result store: identical inputs and POI data mean an identical result
+    search_key = result_key(route_points, search_config.place_types)
+    with _INFLIGHT_LOCK:
+        job = _join_inflight(search_key)
+        if job is not None:
+            subscriber = job.attach()
+            logger.info(f"Search joins in-flight job {job.job_id} ({len(job.subscribers)} subscribers)")
+            STATS.record_search_coalesced(job.job_id)
+            return {"job_id": job.job_id, "subscriber": subscriber, "coalesced": True}
+
+        # Create job
+        job_id = str(uuid.uuid4())
+        job = SearchJob(job_id, search_key)
+        job.route_points = route_points
+        job.gpx_obj = gpx_obj
+        job.search_config = search_config
+        job.filename = filename
+        subscriber = job.attach()
+        JOBS[job_id] = job
+        INFLIGHT[search_key] = job_id
+    STATS.record_search_started(job_id, filename)
+
+    # Launch background thread
+    thread = threading.Thread(
+        target=_run_search_worker,
+        args=(job, route_points, gpx_obj, search_config, prior),
+        daemon=True,
+    )
+    thread.start()
+
+    return {"job_id": job_id, "subscriber": subscriber, "coalesced": False}
 
 
 # ---------------------------------------------------------------------------
@@ -324,16 +466,19 @@ async def start_search(
     config: JSON string like:
       {"petrol": 5.0, "cafe": 0.1, "supermarket": 0.2}
 
-    Returns: {"job_id": "..."}
+    An identical search (same route points and place types) that is still
+    running is joined instead of started again; all submissions then share
+    its progress stream and result.
+
+    Returns: {"job_id": "...", "subscriber": "...", "coalesced": bool}
+    The subscriber token identifies this submission to the stream and cancel
+    endpoints, so one client leaving does not cancel a shared job.
     """
     _cleanup_old_jobs()
 
     # Parse config
     try:
-        place_types_raw = json.loads(config)
-        search_config = SearchConfig(
-            {pt: float(dist) for pt, dist in place_types_raw.items() if float(dist) > 0}
-        )
+        search_config = _parse_config(json.loads(config))
     except Exception as e:
         STATS.record_upload_failed(gpx_file.filename, f"Invalid config: {e}")
         raise HTTPException(status_code=422, detail=f"Invalid config: {e}")
@@ -352,28 +497,69 @@ async def start_search(
         STATS.record_upload_failed(gpx_file.filename, f"GPX parse error: {e}")
         raise HTTPException(status_code=422, detail=f"GPX parse error: {e}")
 
-    # Create job
-    job_id = str(uuid.uuid4())
-    job = SearchJob(job_id)
-    JOBS[job_id] = job
-    STATS.record_search_started(job_id, gpx_file.filename)
+    return _launch_search(route_points, gpx_obj, search_config, gpx_file.filename)
 
-    # Launch background thread
-    thread = threading.Thread(
-        target=_run_search_worker,
-        args=(job, route_points, gpx_obj, search_config),
-        daemon=True,
-    )
-    thread.start()
 
-    return {"job_id": job_id}
+@app.post("/api/search/{job_id}/refine")
+async def refine_search(job_id: str, request: Request):
+    """
+    Re-run a finished search with a changed config, without a new upload.
+
+    Body JSON: {"config": {"petrol": 5.0, "bakery": 0.2}}
+
+    Only what changed is queried — new types, and the ring beyond the old
+    radius of widened types; places of unchanged types, their distances and
+    road routes are carried over from the finished job.
+
+    Returns a new job, like POST /api/search.
+    """
+    parent = JOBS.get(job_id)
+    if not parent:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if parent.status != "done" or not parent.result or parent.search_config is None:
+        raise HTTPException(status_code=409, detail="Only a finished search can be refined")
+
+    body = await request.json()
+    try:
+        search_config = _parse_config(body.get("config", {}))
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Invalid config: {e}")
+    if not search_config.place_types:
+        raise HTTPException(status_code=422, detail="At least one place type must be selected.")
+
+    _cleanup_old_jobs()
+    return _launch_search(parent.route_points, parent.gpx_obj, search_config, parent.filename, prior=parent)
+
+
+@app.post("/api/search/{job_id}/routes")
+async def get_road_routes(job_id: str, request: Request):
+    """
+    Detour road geometry for some places of a finished search, fetched on
+    first request and cached with the job.
+
+    Body JSON: {"place_ids": ["petrol_0", "cafe_2", ...]}
+    Returns: {"road_routes": {place_id: [[lon, lat], ...]}} — places on the
+    track have no detour and are left out.
+    """
+    job = JOBS.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status != "done" or not job.result:
+        raise HTTPException(status_code=409, detail="Job has no results yet")
+
+    body = await request.json()
+    place_ids = [str(pid) for pid in body.get("place_ids", [])]
+    loop = asyncio.get_event_loop()
+    road_routes = await loop.run_in_executor(None, _ensure_road_routes, job, place_ids)
+    return {"road_routes": road_routes}
 
 
 @app.get("/api/search/{job_id}/stream")
-async def stream_search(job_id: str, request: Request):
+async def stream_search(job_id: str, request: Request, subscriber: Optional[str] = None):
     """
     SSE endpoint — streams progress events for a search job.
     Client receives data: {...} lines until type=result, error, or cancelled.
+    A disconnect cancels the job only if no other submission shares it.
     """
     job = JOBS.get(job_id)
     if not job:
@@ -385,7 +571,7 @@ async def stream_search(job_id: str, request: Request):
 
         while True:
             if await request.is_disconnected():
-                job.cancel()
+                job.detach(subscriber)
                 break
 
             events = job.get_events_from(index)
@@ -445,11 +631,17 @@ async def get_results(job_id: str):
 
 
 @app.post("/api/search/{job_id}/cancel")
-async def cancel_search(job_id: str):
+async def cancel_search(job_id: str, subscriber: Optional[str] = None):
+    """
+    Cancel this submission's interest in a job.  A job shared with identical
+    searches keeps running for the others: {"status": "detached"}.
+    """
     job = JOBS.get(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
-    job.cancel()
+    job.detach(subscriber)
+    if not job.is_cancelled():
+        return {"status": "detached"}
     return {"status": "cancellation requested"}
 
 
@@ -508,9 +700,14 @@ async def export_gpx(request: Request):
             result = job.result
             all_places = result["places"]
             selected_places = [p for p in all_places if p["id"] in selected_ids]
-            road_routes = result["road_routes"]
             route_points = result["route_points"]
             gpx_obj = result.get("gpx_obj")
+            if mode == "enhanced_track":
+                # Detour geometry only for the places actually exported
+                loop = asyncio.get_event_loop()
+                road_routes = await loop.run_in_executor(
+                    None, _ensure_road_routes, job, [p["id"] for p in selected_places],
+                )
 
     if not selected_places and not custom_waypoints:
         raise HTTPException(status_code=422, detail="No places or custom waypoints selected")
@@ -583,6 +780,36 @@ def _admin_html(stats: dict) -> str:
     <tbody>{export_rows}</tbody>
   </table>"""
 
+    mirror_rows = "".join(
+        f"<tr><td>{url.split('/')[2]}</td><td>{h['median_s']} s</td>"
+        f"<td>{h['p90_s'] if h['p90_s'] is not None else '—'}</td>"
+        f"<td>{h['error_rate'] * 100:.0f}%</td><td>{h['samples']}</td></tr>"
+        for url, h in stats.get("overpass_mirrors", {}).items()
+    )
+    mirror_section = f"""
+  <h2 style="margin-top:2rem">Overpass Mirrors</h2>
+  <table>
+    <thead><tr><th>Mirror</th><th>Median</th><th>p90 (s)</th><th>Errors</th><th>Samples</th></tr></thead>
+    <tbody>{mirror_rows}</tbody>
+  </table>""" if mirror_rows else ""
+
+    cost_rows = "".join(
+        f"<tr><td>{strategy}</td><td>{c['intercept_s']} s</td><td>{c['slope_s']}</td><td>{c['samples']}</td></tr>"
+        for strategy, c in stats.get("query_costs", {}).items()
+    )
+    cost_section = f"""
+  <h2 style="margin-top:2rem">Query Planner Cost Model</h2>
+  <table>
+    <thead><tr><th>Strategy</th><th>Intercept</th><th>Slope (s / work)</th><th>Samples</th></tr></thead>
+    <tbody>{cost_rows}</tbody>
+  </table>""" if cost_rows else ""
+
+    store = stats.get("result_store", {})
+    store_rate = f"{store['hit_rate'] * 100:.0f}%" if store.get("hit_rate") is not None else "—"
+    routing = stats.get("routing_cache", {})
+    routing_lookups = routing.get("hits", 0) + routing.get("misses", 0)
+    routing_rate = f"{routing['hits'] / routing_lookups * 100:.0f}%" if routing_lookups else "—"
+
     return f"""<!DOCTYPE html>
 <html lang="en">
 <head>
@@ -625,6 +852,9 @@ def _admin_html(stats: dict) -> str:
     <div class="card"><div class="label">Completed</div><div class="value" style="color:#4ade80">{stats['completed_searches']}</div></div>
     <div class="card"><div class="label">Cancelled</div><div class="value" style="color:#fbbf24">{stats['cancelled_searches']}</div></div>
     <div class="card"><div class="label">Failed</div><div class="value" style="color:#f87171">{stats['failed_searches']}</div></div>
+    <div class="card"><div class="label">Joined In-flight</div><div class="value" style="color:#a78bfa">{stats['coalesced_searches']}</div></div>
+    <div class="card"><div class="label">Result Store Hits</div><div class="value" style="color:#a78bfa">{store_rate}</div><div class="label" style="margin-top:.5rem">{store.get('hits', 0)} of {store.get('hits', 0) + store.get('misses', 0)} &middot; {store.get('entries', 0)} stored</div></div>
+    <div class="card"><div class="label">Routing Cache Hits</div><div class="value" style="color:#a78bfa">{routing_rate}</div><div class="label" style="margin-top:.5rem">{routing.get('hits', 0)} of {routing_lookups} &middot; {routing.get('entries', 0)} routes</div></div>
     <div class="card"><div class="label">Waypoints Found</div><div class="value" style="color:#e2e8f0">{stats['total_waypoints_found']}</div></div>
     <div class="card"><div class="label">GPX Exports</div><div class="value" style="color:#e2e8f0">{stats['gpx_exports']}</div></div>
   </div>
@@ -637,6 +867,8 @@ def _admin_html(stats: dict) -> str:
     <tbody>{rows}</tbody>
   </table>
   {export_error_section}
+  {mirror_section}
+  {cost_section}
 
   <p class="footer">Auto-refreshes every 30 seconds</p>
 </body>
@@ -0,0 +1,160 @@
+"""
+Persistent SQLite key/value cache with TTL expiry and a total-size LRU cap.
+
+Values are stored as JSON text.  Every read bumps the entry's last-access
+time; when the total stored size exceeds `max_bytes` the least recently used
+entries are evicted.  Safe to share between threads (one connection + lock).
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# All on-disk caches live here unless a caller passes an explicit path
+CACHE_DIR = Path(os.environ.get("TRACKWISE_CACHE_DIR", Path(__file__).resolve().parent.parent / "cache"))
+
+
+class SqliteCache:
+    """JSON value cache backed by a single SQLite table."""
+
+    def __init__(self, path: Path, ttl_s: float, max_bytes: int):
+        self.path = Path(path)
+        self.ttl_s = ttl_s
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _db(self) -> sqlite3.Connection:
+        """Open the database lazily so importing a module never touches disk."""
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "  key TEXT PRIMARY KEY,"
+                "  value TEXT NOT NULL,"
+                "  size INTEGER NOT NULL,"
+                "  created_at REAL NOT NULL,"
+                "  accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value, or None if missing or older than the TTL."""
+        entry = self.get_entry(key)
+        return entry[0] if entry is not None else None
+
+    def get_entry(self, key: str) -> Optional[Tuple[Any, float]]:
+        """Like get(), but return (value, created_at) so callers can track the data's age."""
+        now = time.time()
+        try:
+            with self._lock:
+                db = self._db()
+                row = db.execute(
+                    "SELECT value, created_at FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None or now - row[1] > self.ttl_s:
+                    if row is not None:
+                        db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                        db.commit()
+                    self.misses += 1
+                    return None
+                db.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+                db.commit()
+                self.hits += 1
+            return json.loads(row[0]), row[1]
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning(f"Cache read failed ({self.path.name}): {e}")
+            return None
+
+    def contains(self, key: str) -> bool:
+        """True if a fresh entry exists; does not touch counters or access time."""
+        try:
+            with self._lock:
+                row = self._db().execute(
+                    "SELECT created_at FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error:
+            return False
+        return row is not None and time.time() - row[0] <= self.ttl_s
+
+    def put(self, key: str, value: Any, created_at: Optional[float] = None) -> None:
+        """
+        Store a JSON-serialisable value, then evict LRU entries over budget.
+
+        created_at: when the value's underlying data was fetched, if earlier
+        than now — the entry then expires with that data, and a value already
+        older than the TTL is not stored at all.
+        """
+        now = time.time()
+        if created_at is None or created_at > now:
+            created_at = now
+        if now - created_at > self.ttl_s:
+            return
+        text = json.dumps(value, separators=(",", ":"))
+        size = len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        try:
+            with self._lock:
+                db = self._db()
+                db.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, size, created_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, text, size, created_at, now),
+                )
+                self._evict(db, now)
+                db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Cache write failed ({self.path.name}): {e}")
+
+    def delete(self, key: str) -> None:
+        try:
+            with self._lock:
+                db = self._db()
+                db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Cache delete failed ({self.path.name}): {e}")
+
+    def _evict(self, db: sqlite3.Connection, now: float) -> None:
+        """Drop expired entries, then least recently used ones until under budget."""
+        db.execute("DELETE FROM entries WHERE created_at < ?", (now - self.ttl_s,))
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        freed = 0
+        victims = []
+        for key, size in db.execute("SELECT key, size FROM entries ORDER BY accessed_at"):
+            victims.append((key,))
+            freed += size
+            if total - freed <= self.max_bytes:
+                break
+        db.executemany("DELETE FROM entries WHERE key = ?", victims)
+        logger.info(f"Cache {self.path.name}: evicted {len(victims)} entries ({freed} bytes)")
+
+    def stats(self) -> dict:
+        """Return entry count, stored bytes and hit/miss counters."""
+        try:
+            with self._lock:
+                count, total = self._db().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+                ).fetchone()
+        except sqlite3.Error:
+            count, total = 0, 0
+        return {"entries": count, "bytes": total, "hits": self.hits, "misses": self.misses}
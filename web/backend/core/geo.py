@@ -0,0 +1,77 @@
+"""
+Local metric projection helpers.
+
+Route segments span at most a few tens of km, so an equirectangular projection
+centred on the segment gives kilometre coordinates accurate to well under 1 %
+— good enough for corridor distances, and unlike `degrees * 111` it stays
+correct at high latitudes.
+"""
+
+from __future__ import annotations
+
+import math
+from typing import Iterable, Tuple
+
+import numpy as np
+import shapely
+from shapely.geometry.base import BaseGeometry
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+class LocalProjection:
+    """Equirectangular (lon, lat) degrees ↔ (x, y) km around a reference point."""
+
+    def __init__(self, lat0: float, lon0: float):
+        self.lat0 = lat0
+        self.lon0 = lon0
+        self.kx = math.radians(1.0) * EARTH_RADIUS_KM * math.cos(math.radians(lat0))
+        self.ky = math.radians(1.0) * EARTH_RADIUS_KM
+
+    @classmethod
+    def for_geometry(cls, geom: BaseGeometry) -> "LocalProjection":
+        c = geom.centroid
+        return cls(c.y, c.x)
+
+    def to_xy(self, lons: np.ndarray, lats: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        return (np.asarray(lons) - self.lon0) * self.kx, (np.asarray(lats) - self.lat0) * self.ky
+
+    def to_lonlat(self, xs: np.ndarray, ys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        return np.asarray(xs) / self.kx + self.lon0, np.asarray(ys) / self.ky + self.lat0
+
+    def forward(self, geom: BaseGeometry) -> BaseGeometry:
+        """Project a lon/lat shapely geometry to km."""
+        return shapely.transform(geom, lambda c: np.column_stack(self.to_xy(c[:, 0], c[:, 1])))
+
+    def inverse(self, geom: BaseGeometry) -> BaseGeometry:
+        """Project a km geometry back to lon/lat."""
+        return shapely.transform(geom, lambda c: np.column_stack(self.to_lonlat(c[:, 0], c[:, 1])))
+
+    def distances_km(
+        self,
+        geom: BaseGeometry,
+        lons: np.ndarray,
+        lats: np.ndarray,
+        tolerance_km: float = 0.0,
+        thresholds_km: Iterable[float] = (),
+    ) -> np.ndarray:
+        """
+        Distance in km from each (lon, lat) point to a lon/lat geometry, vectorized.
+
+        With a tolerance, points are first measured against the geometry
+        simplified by it — off by at most tolerance_km, and far fewer vertices.
+        Only points that close to one of `thresholds_km` are measured exactly,
+        so comparing the result with a threshold is still exact.
+        """
+        xs, ys = self.to_xy(lons, lats)
+        points = shapely.points(xs, ys)
+        metric = self.forward(geom)
+        if tolerance_km <= 0:
+            return shapely.distance(metric, points)
+        dists = shapely.distance(shapely.simplify(metric, tolerance_km, preserve_topology=False), points)
+        band = np.zeros(len(dists), dtype=bool)
+        for threshold in set(thresholds_km):
+            band |= np.abs(dists - threshold) <= tolerance_km
+        if band.any():
+            dists[band] = shapely.distance(metric, points[band])
+        return dists
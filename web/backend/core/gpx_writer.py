@@ -20,6 +20,13 @@ def _garmin_symbol(place_type: str) -> str:
     return PLACE_TYPE_CONFIG.get(place_type, {}).get("garmin_symbol", "Flag, Blue")
 
 
+def _place_description(place: dict, cfg: dict) -> str:
+    text = f"{cfg.get('name', 'Place')}: {place['base_name']} - Distance from route: {place['distance_km']} km"
+    if place.get("detour_km"):
+        text += f" - Detour: {place['detour_km']} km / {place['detour_min']:.0f} min"
+    return text
+
+
 def _append_custom_waypoints(gpx_out, custom_waypoints: Optional[List[dict]]) -> None:
     """Append custom user-placed waypoints to a GPX object."""
     if not custom_waypoints:
@@ -54,10 +61,7 @@ def build_waypoints_only_gpx(
             latitude=place["lat"],
             longitude=place["lon"],
             name=make_waypoint_name(place, counters[pt]),
-            description=(
-                f"{cfg.get('name', 'Place')}: {place['base_name']} "
-                f"- Distance from route: {place['distance_km']} km"
-            ),
+            description=_place_description(place, cfg),
             symbol=_garmin_symbol(pt),
         )
         gpx_out.waypoints.append(wpt)
@@ -94,10 +98,7 @@ def build_track_with_waypoints_gpx(
             latitude=place["lat"],
             longitude=place["lon"],
             name=make_waypoint_name(place, counters[pt]),
-            description=(
-                f"{cfg.get('name', 'Place')}: {place['base_name']} "
-                f"- Distance from route: {place['distance_km']} km"
-            ),
+            description=_place_description(place, cfg),
             symbol=_garmin_symbol(pt),
         )
         gpx_out.waypoints.append(wpt)
@@ -190,10 +191,7 @@ def build_enhanced_track_gpx(
             latitude=place["lat"],
             longitude=place["lon"],
             name=make_waypoint_name(place, counters[pt]),
-            description=(
-                f"{cfg.get('name', 'Place')}: {place['base_name']} "
-                f"- Distance from route: {place['distance_km']} km"
-            ),
+            description=_place_description(place, cfg),
             symbol=_garmin_symbol(pt),
         )
         gpx_out.waypoints.append(wpt)
@@ -0,0 +1,84 @@
+"""
+Shared HTTP sessions for the external services (Overpass, OSRM, Valhalla).
+
+One requests.Session per scheme + host, so connections — and their TLS
+handshakes — are kept alive and reused across requests, searches and jobs
+instead of being opened for every call.  Each session's pool holds up to
+HTTP_POOL_SIZE connections, enough for the Overpass scheduler's hedged
+requests and the parallel OSRM workers.
+
+Connection failures are retried here with a short back-off (the request never
+reached the server, so this is safe for POST too); idempotent GETs also get
+one retry after a dropped connection.  HTTP status codes are left to the
+callers — Overpass has its own rate-limit and mirror failover handling.
+Every request uses HTTP_CONNECT_TIMEOUT_S to connect; the read timeout is
+the caller's.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+HTTP_POOL_SIZE = int(os.environ.get("TRACKWISE_HTTP_POOL_SIZE", "8"))   # kept-alive connections per host
+HTTP_CONNECT_TIMEOUT_S = 5.0
+HTTP_CONNECT_RETRIES = 2
+HTTP_RETRY_BACKOFF_S = 0.5   # urllib3 back-off factor: 0.5s, 1s, ...
+USER_AGENT = "TrackWise (+https://github.com/janvangent1/TrackWise)"
+
+_SESSIONS: Dict[str, requests.Session] = {}
+_LOCK = threading.Lock()
+
+
+def _new_session() -> requests.Session:
+    retry = Retry(
+        total=HTTP_CONNECT_RETRIES,
+        connect=HTTP_CONNECT_RETRIES,
+        read=1,          # only for idempotent methods (urllib3 default allowed_methods)
+        status=0,
+        redirect=3,
+        backoff_factor=HTTP_RETRY_BACKOFF_S,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = USER_AGENT
+    return session
+
+
+def session_for(url: str) -> requests.Session:
+    """Return the shared session for the URL's scheme and host, creating it on first use."""
+    parts = urlsplit(url)
+    origin = f"{parts.scheme}://{parts.netloc}"
+    with _LOCK:
+        session = _SESSIONS.get(origin)
+        if session is None:
+            session = _SESSIONS[origin] = _new_session()
+            logger.debug(f"HTTP pool opened for {origin}")
+        return session
+
+
+def _timeout(read_timeout_s: Optional[float]) -> tuple:
+    return (HTTP_CONNECT_TIMEOUT_S, read_timeout_s)
+
+
+def get(url: str, timeout: Optional[float] = None, **kwargs) -> requests.Response:
+    """requests.get over the host's pooled session; `timeout` is the read timeout."""
+    return session_for(url).get(url, timeout=_timeout(timeout), **kwargs)
+
+
+def post(url: str, timeout: Optional[float] = None, **kwargs) -> requests.Response:
+    """requests.post over the host's pooled session; `timeout` is the read timeout."""
+    return session_for(url).post(url, timeout=_timeout(timeout), **kwargs)
+
@@ -0,0 +1,86 @@
+"""
+Mirror health tracking — rolling latency and error rate per server URL.
+
+Used by the Overpass scheduler to send each query to the healthiest mirror
+first and to decide when a slow request deserves a hedged duplicate.
+"""
+
+from __future__ import annotations
+
+import statistics
+import threading
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional
+
+HEALTH_WINDOW = 20          # last N requests per mirror
+HEALTH_MIN_SAMPLES = 5      # below this, fall back to the defaults
+DEFAULT_LATENCY_S = 10.0    # assumed latency of a mirror we know nothing about
+DEFAULT_HEDGE_AFTER_S = 15.0
+MIN_HEDGE_AFTER_S = 2.0
+
+
+class MirrorHealth:
+    """Rolling window of request outcomes for one mirror."""
+
+    def __init__(self):
+        self.latencies: Deque[float] = deque(maxlen=HEALTH_WINDOW)
+        self.outcomes: Deque[bool] = deque(maxlen=HEALTH_WINDOW)
+
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def median(self) -> float:
+        return statistics.median(self.latencies) if self.latencies else DEFAULT_LATENCY_S
+
+    def p90(self) -> Optional[float]:
+        if len(self.latencies) < HEALTH_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(0.9 * (len(ordered) - 1))]
+
+    def score(self) -> float:
+        """Expected cost of a request here — lower is healthier."""
+        return self.median() * (1.0 + 3.0 * self.error_rate())
+
+
+class MirrorPool:
+    """Health scores for a fixed list of mirrors; thread-safe."""
+
+    def __init__(self, mirrors: Iterable[str]):
+        self._lock = threading.Lock()
+        self._health: Dict[str, MirrorHealth] = {m: MirrorHealth() for m in mirrors}
+
+    def record(self, mirror: str, ok: bool, latency_s: float) -> None:
+        """Record a finished request (ok=False for errors and timeouts)."""
+        with self._lock:
+            health = self._health.setdefault(mirror, MirrorHealth())
+            health.latencies.append(latency_s)
+            health.outcomes.append(ok)
+
+    def record_latency(self, mirror: str, latency_s: float) -> None:
+        """Record a lower-bound latency for a request that was cancelled as a hedge loser."""
+        with self._lock:
+            self._health.setdefault(mirror, MirrorHealth()).latencies.append(latency_s)
+
+    def ranked(self, mirrors: Iterable[str]) -> List[str]:
+        """Return the given mirrors healthiest first (stable for equal scores)."""
+        with self._lock:
+            return sorted(mirrors, key=lambda m: self._health.get(m, MirrorHealth()).score())
+
+    def hedge_after(self, mirror: str) -> float:
+        """Seconds to wait on `mirror` before sending a hedged duplicate (its p90)."""
+        with self._lock:
+            p90 = self._health.get(mirror, MirrorHealth()).p90()
+        return DEFAULT_HEDGE_AFTER_S if p90 is None else max(p90, MIN_HEDGE_AFTER_S)
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            return {
+                m: {
+                    "median_s": round(h.median(), 2),
+                    "p90_s": round(h.p90(), 2) if h.p90() is not None else None,
+                    "error_rate": round(h.error_rate(), 2),
+                    "samples": len(h.outcomes),
+                }
+                for m, h in self._health.items()
+            }
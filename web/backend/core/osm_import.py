@@ -0,0 +1,235 @@
+"""
+Build the offline POI index (core/poi_index.py) from an OSM extract.
+
+Supports OSM XML (.osm, .osm.gz, .osm.bz2) with the standard library, and
+PBF (.osm.pbf) when the optional `osmium` package is installed.  Only nodes
+carrying a tag from PLACE_TYPE_CONFIG are kept.  OSM change files (.osc,
+.osc.gz) are applied incrementally so the index stays fresh without a re-import.
+
+Usage (from web/backend):
+    python -m core.osm_import belgium-latest.osm.pbf [--index path/to/poi_index.sqlite]
+    python -m core.osm_import --diff 4567.osc.gz 4568.osc.gz
+"""
+
+from __future__ import annotations
+
+import argparse
+import bz2
+import gzip
+import logging
+import time
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import IO, Dict, Iterator, List, Optional, Set, Tuple
+
+from .poi_index import POI_INDEX_PATH, PoiIndex, filter_tags, relevant_tags
+
+logger = logging.getLogger(__name__)
+
+IMPORT_BATCH = 5000  # rows per SQLite transaction
+
+PoiRow = Tuple[int, float, float, Dict[str, str]]  # (osm_id, lat, lon, kept tags)
+
+
+def _open_xml(path: Path) -> IO[bytes]:
+    if path.suffix == ".gz":
+        return gzip.open(path, "rb")
+    if path.suffix == ".bz2":
+        return bz2.open(path, "rb")
+    return open(path, "rb")
+
+
+def _iter_xml_nodes(path: Path, wanted: Dict[str, Set[str]]) -> Iterator[PoiRow]:
+    """Stream <node> elements with matching tags; memory stays flat on big files."""
+    with _open_xml(path) as fh:
+        root = None
+        for event, elem in ET.iterparse(fh, events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = elem
+                continue
+            if elem.tag == "node":
+                tags = {t.get("k"): t.get("v") for t in elem.iter("tag")}
+                kept = filter_tags(tags, wanted) if tags else None
+                if kept:
+                    yield int(elem.get("id")), float(elem.get("lat")), float(elem.get("lon")), kept
+            if elem.tag in ("node", "way", "relation"):
+                # Detach finished elements from <osm>; clearing only the element
+                # itself would leave an empty shell per node attached to the tree
+                root.clear()
+
+
+def _iter_pbf_nodes(path: Path, wanted: Dict[str, Set[str]]) -> Iterator[PoiRow]:
+    """Stream matching nodes from a PBF file via pyosmium."""
+    try:
+        import osmium
+    except ImportError:
+        raise RuntimeError("PBF import needs the optional 'osmium' package: pip install osmium")
+
+    rows: list = []
+
+    class _Handler(osmium.SimpleHandler):
+        def node(self, n):
+            if not n.tags:
+                return
+            kept = filter_tags({t.k: t.v for t in n.tags}, wanted)
+            if kept and n.location.valid():
+                rows.append((n.id, n.location.lat, n.location.lon, kept))
+
+    # pyosmium pushes into the handler; matching nodes are a tiny fraction of the
+    # file so collecting them before yielding is fine.
+    _Handler().apply_file(str(path), locations=False)
+    yield from rows
+
+
+def iter_poi_nodes(path: Path) -> Iterator[PoiRow]:
+    """Yield (osm_id, lat, lon, tags) for every relevant node in an extract."""
+    wanted = relevant_tags()
+    if path.name.endswith(".pbf"):
+        return _iter_pbf_nodes(path, wanted)
+    return _iter_xml_nodes(path, wanted)
+
+
+def import_extract(path: Path, index_path: Path = POI_INDEX_PATH) -> dict:
+    """
+    Import an OSM extract into the POI index at index_path.
+
+    Returns {"rows": int, "seconds": float}.
+    """
+    path = Path(path)
+    started = time.time()
+    index = PoiIndex(index_path)
+    try:
+        batch: list = []
+        total = 0
+        for row in iter_poi_nodes(path):
+            batch.append(row)
+            if len(batch) >= IMPORT_BATCH:
+                total += index.upsert_many(batch)
+                batch = []
+                logger.info(f"Imported {total} POIs…")
+        total += index.upsert_many(batch)
+        index.set_meta("source", path.name)
+        index.set_meta("imported_at", time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()))
+    finally:
+        index.close()
+
+    elapsed = time.time() - started
+    logger.info(f"Import of {path.name} done — {total} POIs in {elapsed:.1f}s")
+    return {"rows": total, "seconds": elapsed}
+
+
+def _iter_change_nodes(path: Path) -> Iterator[Tuple[str, int, Optional[float], Optional[float], Dict[str, str]]]:
+    """Yield (action, osm_id, lat, lon, tags) for each node in an osmChange file."""
+    action = ""
+    root = block = None
+    with _open_xml(path) as fh:
+        for event, elem in ET.iterparse(fh, events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = elem
+                elif elem.tag in ("create", "modify", "delete"):
+                    action, block = elem.tag, elem
+                continue
+            if elem.tag == "node":
+                tags = {t.get("k"): t.get("v") for t in elem.iter("tag")}
+                lat, lon = elem.get("lat"), elem.get("lon")
+                yield (
+                    action,
+                    int(elem.get("id")),
+                    float(lat) if lat is not None else None,
+                    float(lon) if lon is not None else None,
+                    tags,
+                )
+            # Detach finished elements so a large action block does not grow
+            if elem.tag in ("node", "way", "relation") and block is not None:
+                block.clear()
+            elif elem.tag in ("create", "modify", "delete"):
+                root.clear()
+                block = None
+
+
+def apply_change_file(path: Path, index: PoiIndex) -> dict:
+    """
+    Apply one OSM change file to the POI index in place.
+
+    Created/modified nodes with a relevant tag are upserted; deleted nodes, and
+    modified nodes that lost their relevant tags, are removed — only if the
+    index holds them.  Everything else in the diff (ways, relations, untagged
+    nodes) is skipped.  When a node appears more than once, its last state wins.
+
+    Returns {"file", "upserted", "deleted", "rows_changed", "seconds"}.
+    """
+    path = Path(path)
+    started = time.time()
+    wanted = relevant_tags()
+
+    upserts: Dict[int, PoiRow] = {}
+    deletes: Set[int] = set()
+    unchecked: List[int] = []  # no longer relevant — delete only if the index has them
+
+    def _check_unchecked() -> None:
+        deletes.update(osm_id for osm_id in index.existing(unchecked) if osm_id not in upserts)
+        unchecked.clear()
+
+    for action, osm_id, lat, lon, tags in _iter_change_nodes(path):
+        kept = filter_tags(tags, wanted) if action != "delete" and tags else None
+        if kept and lat is not None and lon is not None:
+            upserts[osm_id] = (osm_id, lat, lon, kept)
+            deletes.discard(osm_id)
+        elif action == "create" and osm_id not in upserts:
+            continue  # a new node without a relevant tag: nothing to undo
+        elif upserts.pop(osm_id, None) is not None:
+            deletes.add(osm_id)  # relevant earlier in this diff
+        else:
+            unchecked.append(osm_id)
+            if len(unchecked) >= IMPORT_BATCH:
+                _check_unchecked()
+    _check_unchecked()
+
+    upserted = index.upsert_many(upserts.values())
+    deleted = index.delete_many(deletes)
+    index.set_meta("updated_at", time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()))
+    index.set_meta("last_diff", path.name)
+
+    elapsed = time.time() - started
+    logger.info(
+        f"Applied {path.name} in {elapsed:.2f}s — {upserted} upserted, {deleted} deleted "
+        f"({len(upserts) + len(deletes)} relevant node changes in diff)"
+    )
+    return {
+        "file": path.name,
+        "upserted": upserted,
+        "deleted": deleted,
+        "rows_changed": upserted + deleted,
+        "seconds": elapsed,
+    }
+
+
+def apply_change_files(paths: List[Path], index_path: Path = POI_INDEX_PATH) -> List[dict]:
+    """Apply change files in the given order; returns one report per file."""
+    index = PoiIndex(index_path)
+    try:
+        return [apply_change_file(p, index) for p in paths]
+    finally:
+        index.close()
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s — %(message)s")
+    parser = argparse.ArgumentParser(description="Build the TrackWise offline POI index.")
+    parser.add_argument("files", type=Path, nargs="+",
+                        help="OSM extract (.osm, .osm.gz, .osm.bz2 or .osm.pbf), or change files with --diff")
+    parser.add_argument("--diff", action="store_true", help="apply the files as .osc change files, in order")
+    parser.add_argument("--index", type=Path, default=POI_INDEX_PATH, help="index file to create/update")
+    args = parser.parse_args()
+    if args.diff:
+        for report in apply_change_files(args.files, args.index):
+            print(f"{report['file']}: {report['rows_changed']} rows changed in {report['seconds']:.2f}s")
+    else:
+        for extract in args.files:
+            import_extract(extract, args.index)
+
+
+if __name__ == "__main__":
+    main()
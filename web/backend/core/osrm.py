@@ -1,19 +1,30 @@
 """
 OSRM road routing — find actual road path from route to POI.
 Extracted from main_gui_enhanced.py, GUI-free.
+
+Successful answers are kept in the persistent routing cache
+(core/routing_cache.py), so repeated detours cost no request.
 """
 
 from __future__ import annotations
 
 import logging
+import os
 from typing import List, Optional, Tuple
 
 import requests
 
+from . import http_client
+from .routing_cache import ROUTING_CACHE, routing_key
+
 logger = logging.getLogger(__name__)
 
-OSRM_BASE = "http://router.project-osrm.org/route/v1"
+# TRACKWISE_OSRM_URL points at another OSRM server, e.g. a local one or a test stand-in
+OSRM_URL = os.environ.get("TRACKWISE_OSRM_URL", "http://router.project-osrm.org").rstrip("/")
+OSRM_BASE = f"{OSRM_URL}/route/v1"
+OSRM_TABLE_BASE = f"{OSRM_URL}/table/v1"
 OSRM_PROFILES = {"driving", "cycling", "foot"}
+MAX_TABLE_COORDS = 100  # public server limit on coordinates per table request
 
 
 RoutePoint = Tuple[float, float]  # (longitude, latitude)
@@ -30,13 +41,18 @@ def get_road_route(
 
     Returns list of (lon, lat) tuples, or None on failure.
     """
+    cache_key = routing_key("osrm", "driving", [(start_lat, start_lon), (end_lat, end_lon)])
+    cached = ROUTING_CACHE.get(cache_key)
+    if cached is not None:
+        return [tuple(coord) for coord in cached]
+
     url = (
         f"{OSRM_BASE}/driving/{start_lon},{start_lat};{end_lon},{end_lat}"
         "?overview=full&geometries=geojson"
     )
 
     try:
-        response = requests.get(url, timeout=6)
+        response = http_client.get(url, timeout=6)
         response.raise_for_status()
         data = response.json()
 
@@ -51,7 +67,9 @@ def get_road_route(
             return None
 
         # GeoJSON coords are [lon, lat]
-        return [(coord[0], coord[1]) for coord in coordinates]
+        route = [(coord[0], coord[1]) for coord in coordinates]
+        ROUTING_CACHE.put(cache_key, route)
+        return route
 
     except requests.exceptions.ConnectionError:
         logger.warning("OSRM connection error")
@@ -85,11 +103,16 @@ def get_road_route_multi(
     if profile not in OSRM_PROFILES:
         profile = "cycling"
 
+    cache_key = routing_key("osrm", profile, waypoints)
+    cached = ROUTING_CACHE.get(cache_key)
+    if cached is not None:
+        return [tuple(coord) for coord in cached]
+
     coords = ";".join(f"{lon},{lat}" for lat, lon in waypoints)
     url = f"{OSRM_BASE}/{profile}/{coords}?overview=full&geometries=geojson"
 
     try:
-        response = requests.get(url, timeout=10)
+        response = http_client.get(url, timeout=10)
         response.raise_for_status()
         data = response.json()
 
@@ -103,7 +126,9 @@ def get_road_route_multi(
         if not coordinates:
             return None
 
-        return [(coord[0], coord[1]) for coord in coordinates]
+        route = [(coord[0], coord[1]) for coord in coordinates]
+        ROUTING_CACHE.put(cache_key, route)
+        return route
 
     except requests.exceptions.ConnectionError:
         logger.warning("OSRM connection error")
@@ -118,3 +143,109 @@ def get_road_route_multi(
     except Exception as e:
         logger.error(f"OSRM unexpected error: {e}")
         return None
+
+
+def get_detour_table(
+    pairs: List[Tuple[float, float, float, float]],
+    profile: str = "driving",
+) -> Optional[List[Optional[Tuple[float, float]]]]:
+    """
+    Road detour cost for many places in one pair of OSRM `table` requests.
+
+    pairs: (start_lat, start_lon, end_lat, end_lon) per place — the route
+        access point and the place; at most MAX_TABLE_COORDS // 2 pairs.
+    Returns per pair (round-trip km, round-trip minutes) — route → place → route —
+    or None for a pair without a road connection; None if the request failed.
+    Pairs answered before come from the routing cache; only the rest are requested.
+    """
+    if not pairs:
+        return []
+    if 2 * len(pairs) > MAX_TABLE_COORDS:
+        raise ValueError(f"At most {MAX_TABLE_COORDS // 2} pairs per table request")
+    if profile not in OSRM_PROFILES:
+        profile = "driving"
+
+    keys = [
+        routing_key("osrm", profile, [(s_lat, s_lon), (e_lat, e_lon)], "table")
+        for s_lat, s_lon, e_lat, e_lon in pairs
+    ]
+    costs: List[Optional[Tuple[float, float]]] = []
+    missing: List[int] = []
+    for i, key in enumerate(keys):
+        cached = ROUTING_CACHE.get(key)
+        costs.append(tuple(cached) if cached is not None else None)
+        if cached is None:
+            missing.append(i)
+    if not missing:
+        return costs
+
+    fetched = _request_table([pairs[i] for i in missing], profile)
+    if fetched is None:
+        return None
+    for i, cost in zip(missing, fetched):
+        costs[i] = cost
+        if cost is not None:
+            ROUTING_CACHE.put(keys[i], cost)
+    return costs
+
+
+def _request_table(
+    pairs: List[Tuple[float, float, float, float]],
+    profile: str,
+) -> Optional[List[Optional[Tuple[float, float]]]]:
+    n = len(pairs)
+    # Coordinates 0..n-1 are the access points, n..2n-1 the places
+    coords = ";".join(
+        [f"{s_lon},{s_lat}" for s_lat, s_lon, _, _ in pairs]
+        + [f"{e_lon},{e_lat}" for _, _, e_lat, e_lon in pairs]
+    )
+    access = ";".join(str(i) for i in range(n))
+    places = ";".join(str(n + i) for i in range(n))
+    # Only the legs between access points and places are wanted: two n×n
+    # tables (out and back) instead of the full 2n×2n matrix
+    out = _table_legs(f"{OSRM_TABLE_BASE}/{profile}/{coords}?annotations=distance,duration"
+                      f"&sources={access}&destinations={places}")
+    if out is None:
+        return None
+    back = _table_legs(f"{OSRM_TABLE_BASE}/{profile}/{coords}?annotations=distance,duration"
+                       f"&sources={places}&destinations={access}")
+    if back is None:
+        return None
+
+    costs: List[Optional[Tuple[float, float]]] = []
+    for i in range(n):
+        legs_m = (out[0][i][i], back[0][i][i])
+        legs_s = (out[1][i][i], back[1][i][i])
+        if None in legs_m or None in legs_s:
+            costs.append(None)
+        else:
+            costs.append((sum(legs_m) / 1000.0, sum(legs_s) / 60.0))
+    return costs
+
+
+def _table_legs(url: str) -> Optional[Tuple[List[List[Optional[float]]], List[List[Optional[float]]]]]:
+    """(distances, durations) rows of one OSRM table request, or None on failure."""
+    try:
+        response = http_client.get(url, timeout=15)
+        response.raise_for_status()
+        data = response.json()
+        distances = data.get("distances")
+        durations = data.get("durations")
+        if data.get("code") != "Ok" or not distances or not durations:
+            logger.debug(f"OSRM table: {data.get('code')} {data.get('message', '')}")
+            return None
+        return distances, durations
+
+    except requests.exceptions.ConnectionError:
+        logger.warning("OSRM table connection error")
+        return None
+    except requests.exceptions.Timeout:
+        logger.warning("OSRM table timeout")
+        return None
+    except requests.exceptions.HTTPError as e:
+        code = e.response.status_code if e.response is not None else 0
+        logger.warning(f"OSRM table HTTP {code}")
+        return None
+    except Exception as e:
+        logger.error(f"OSRM table unexpected error: {e}")
+        return None
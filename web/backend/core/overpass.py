@@ -1,62 +1,348 @@
 """
 Overpass API queries — find OSM POIs along route segments.
 
-Uses the Overpass `around` filter with route waypoints instead of bounding boxes.
-This scans only the route corridor, not a large rectangle, which is far more
-efficient on the public Overpass server and avoids 504 timeouts.
+Queries only the route corridor — by default with the Overpass `around` filter
+over the route waypoints, or a `poly`/bbox filter when the query planner
+(core/query_planner.py) expects that to be cheaper.  This scans the corridor,
+not a large rectangle, which is far more efficient on the public Overpass
+server and avoids 504 timeouts.
 """
 
 from __future__ import annotations
 
+import codecs
+import hashlib
+import json
 import logging
+import math
+import os
+import re
+import threading
 import time
-from typing import Callable, Dict, List, Optional, Tuple
+from collections import deque
+from email.utils import parsedate_to_datetime
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
+import numpy as np
 import requests
-from shapely.geometry import LineString, Point
+import shapely
+from shapely.geometry import box
+from shapely.geometry.base import BaseGeometry
+from shapely.ops import unary_union
+
+from . import http_client
+from .cache import CACHE_DIR, SqliteCache
+from .geo import LocalProjection
+from .mirrors import MirrorPool
+from .poi_index import filter_tags, get_index
+from .query_planner import COST_MODEL, plan_query
+from .tiles import Tile, corridor_tiles, group_by_tile, has_tile, load_tile, store_tile, tile_bounds
 
 logger = logging.getLogger(__name__)
 
-# Public Overpass mirrors — tried in order on retry
+# Public Overpass mirrors — the healthiest one with a free slot is used first.
+# TRACKWISE_OVERPASS_MIRRORS (comma-separated) overrides the list, e.g. to point
+# at a local Overpass instance or stand-in test servers.
 OVERPASS_MIRRORS = [
-    "https://overpass-api.de/api/interpreter",
-    "https://overpass.kumi.systems/api/interpreter",
+    m.strip() for m in os.environ.get(
+        "TRACKWISE_OVERPASS_MIRRORS",
+        "https://overpass-api.de/api/interpreter,https://overpass.kumi.systems/api/interpreter",
+    ).split(",") if m.strip()
 ]
 MAX_RETRIES = 1   # 1 retry = 2 attempts max; worst case 45s + 6s + 45s = ~96s
-# Minimum pause between consecutive HTTP requests to the same server (seconds).
-# Sequential queries — no parallel requests — so this is a simple sleep.
+# Back-off base after a failed request; the failing mirror is blocked for
+# REQUEST_PAUSE * 2**attempt seconds for every job, not per job.
 REQUEST_PAUSE = 3.0
+# Minimum interval between requests to the same mirror (token bucket refill).
+# Shared by all jobs in the process via SCHEDULER.  Kept short because rate
+# limits are honoured exactly: on HTTP 429 / "rate_limited" the mirror is held
+# until Retry-After or the slot time published at /api/status.
+OVERPASS_PAUSE = 1.0
+MAX_RATE_LIMIT_WAITS = 4   # re-queues per query after a rate-limit answer
+RATE_LIMIT_MARGIN_S = 0.5  # added to the published slot time
 
+# Persistent response cache — identical corridor + type/radius queries are
+# answered from disk instead of the public servers.
+RESPONSE_CACHE_TTL_S = 7 * 24 * 3600      # OSM POIs change slowly; a week is fine
+RESPONSE_CACHE_MAX_BYTES = 200 * 1024 * 1024
+RESPONSE_CACHE = SqliteCache(CACHE_DIR / "overpass.sqlite", RESPONSE_CACHE_TTL_S, RESPONSE_CACHE_MAX_BYTES)
 
-def _send_query(
-    query: str,
-    label: str,
-    retry_count: int = 0,
-    cancel_check: Optional[Callable[[], bool]] = None,
-) -> Dict:
-    """Send a single Overpass QL query, with simple retry on failure."""
-    if cancel_check and cancel_check():
-        return {}
+# Where collect_all_types_from_segment gets its POIs:
+#   "around" — one corridor query per segment (default)
+#   "tiles"  — fixed z12 tiles shared between overlapping routes (core/tiles.py)
+#   "offline" — local OSM extract index, no network at all (core/poi_index.py)
+POI_BACKEND = os.environ.get("TRACKWISE_POI_BACKEND", "around")
+TILE_BATCH = 12  # tiles per Overpass request when filling the tile store
 
-    if retry_count > 0:
-        delay = REQUEST_PAUSE * (2 ** retry_count)
-        logger.info(f"[{label}] waiting {delay:.0f}s before retry {retry_count}…")
-        time.sleep(delay)
-        if cancel_check and cancel_check():
-            return {}
+# Cross-job batching: queued queries from different searches are merged into one
+# request while their estimated answer size stays within this share of maxsize.
+OVERPASS_MAXSIZE = 134217728
+BATCH_MAX_QUERIES = 6
+BATCH_BUDGET_BYTES = OVERPASS_MAXSIZE // 2
+COMPACT_TYPE = "poi"   # element type of results projected by `convert` (see build_query)
+_NODE_CLAUSE = re.compile(r"^\s*\(?node\b")   # plain or ring (difference) node clause
 
-    url = OVERPASS_MIRRORS[retry_count % len(OVERPASS_MIRRORS)]
-    logger.info(f"[{label}] → {url.split('/')[2]}")
+# The `around` linestring is the route simplified (Douglas–Peucker) with a
+# tolerance of this share of the smallest radius; every radius is padded by
+# the tolerance so the simplified corridor still covers the exact one.
+SIMPLIFY_FRACTION = 0.2
+MIN_SIMPLIFY_KM = 0.005
+MAX_AROUND_POINTS = 1000   # tolerance is doubled until the linestring fits
+# Local classification measures against the segment simplified by this much;
+# reported distances are off by at most this, radius tests are exact.
+CLASSIFY_TOLERANCE_KM = 0.02
+EST_BYTES_PER_KM2 = 2000   # rough answer size per km² of corridor per type clause
+
+
+def build_query(
+    clauses: List[str],
+    prelude: Optional[List[str]] = None,
+    output_keys: Optional[List[str]] = None,
+) -> str:
+    """
+    Wrap union clauses in the standard header/footer.  `prelude` statements
+    (named set assignments the clauses refer to) run before the union.
 
+    With `output_keys` (node-only queries) each result is projected down to its
+    id, coordinates, name and those tags with `convert`, instead of returning
+    every OSM tag; _expand_compact turns it back into a regular element.
+    """
+    # timeout:60 — tell the server to allow 60s; maxsize limits memory usage
+    head = "".join(f"{statement}\n" for statement in prelude or [])
+    body = "\n".join(clauses)
+    if output_keys:
+        fields = ", ".join(f'{key}=t["{key}"]' for key in ["name", *output_keys])
+        out = f"convert {COMPACT_TYPE} ::id=id(), {fields}, lat=lat(), lon=lon();\nout;\n"
+    else:
+        out = "out center tags;\n"
+    return f"[out:json][timeout:60][maxsize:{OVERPASS_MAXSIZE}];\n{head}(\n{body}\n);\n{out}"
+
+
+def _expand_compact(element: dict) -> dict:
+    """Turn a `convert`ed result back into {"type": "node", "id", "lat", "lon", "tags"}."""
+    tags = element.get("tags", {})
     try:
-        response = requests.post(url, data={"data": query}, timeout=45)
+        lat, lon = float(tags["lat"]), float(tags["lon"])
+    except (KeyError, ValueError):
+        lat = lon = None
+    return {
+        "type": "node",
+        "id": element.get("id"),
+        "lat": lat,
+        "lon": lon,
+        "tags": {k: v for k, v in tags.items() if v and k not in ("lat", "lon")},
+    }
+
+
+def _estimate_bytes(corridor: BaseGeometry, n_clauses: int) -> int:
+    """Very rough answer size for a query over `corridor` (lon/lat degrees)."""
+    lat0 = corridor.centroid.y if not corridor.is_empty else 0.0
+    area_km2 = corridor.area * 111.0 * 111.0 * max(math.cos(math.radians(lat0)), 0.01)
+    return int(area_km2 * EST_BYTES_PER_KM2 * max(n_clauses, 1))
+
+
+class QueryTooLarge(Exception):
+    """The segment's query timed out or hit maxsize — retry it as smaller pieces."""
+
+
+class QueryTimedOut(QueryTooLarge):
+    """
+    No answer within the client timeout, on a retry on another mirror too.
+    Split like a too-large query, but it may be the network, not the data.
+    """
+
+
+class QueryFailed(Exception):
+    """No mirror returned an answer — the segment's POIs are unknown, not absent."""
+
+
+# Remarks Overpass sends when a query exceeded [timeout:] or [maxsize:]
+_TOO_LARGE_REMARKS = ("timed out", "out of memory", "maxsize")
+# Stands in for the answer when the mirror sent nothing within the read timeout
+CLIENT_TIMEOUT_REMARK = "client timeout: no answer from the mirror"
+
+
+def _too_large(data: Optional[Dict]) -> bool:
+    """True when the server cut an answer short because the query was too heavy."""
+    remark = (data or {}).get("remark", "")
+    return any(marker in remark for marker in _TOO_LARGE_REMARKS)
+
+
+def _timed_out(data: Optional[Dict]) -> bool:
+    """True for the stand-in answer of a request that hit the client timeout."""
+    return (data or {}).get("remark") == CLIENT_TIMEOUT_REMARK
+
+
+class _Cancelled(Exception):
+    """Internal: a hedged request lost the race while streaming."""
+
+
+class RateLimited(Exception):
+    """The mirror refused a query for quota reasons; a slot frees in `wait_s` seconds."""
+
+    def __init__(self, wait_s: float):
+        super().__init__(f"rate limited for {wait_s:.1f}s")
+        self.wait_s = wait_s
+
+
+def _parse_status(text: str) -> Optional[float]:
+    """
+    Seconds until the next free slot according to an Overpass /api/status page,
+    0 if a slot is free now, or None if the page has no slot information.
+    """
+    available = re.search(r"(\d+) slots? available now", text)
+    if available and int(available.group(1)) > 0:
+        return 0.0
+    waits = [int(w) for w in re.findall(r"Slot available after: \S+, in (-?\d+) seconds?", text)]
+    if waits:
+        return float(max(0, min(waits)))
+    if re.search(r"Rate limit: 0\b", text):
+        return 0.0  # server does not limit this IP
+    return None
+
+
+def _status_wait(url: str) -> Optional[float]:
+    """Ask the mirror's /api/status when our next slot frees up."""
+    status_url = url.rsplit("/", 1)[0] + "/status"
+    try:
+        response = http_client.get(status_url, timeout=5)
         response.raise_for_status()
-        return response.json()
+        return _parse_status(response.text)
+    except Exception as e:
+        logger.debug(f"Overpass status check failed ({status_url}): {e}")
+        return None
+
+
+def _rate_limit_wait(url: str, response: Optional[requests.Response]) -> float:
+    """Retry-After header first, then /api/status, then the usual back-off."""
+    header = response.headers.get("Retry-After") if response is not None else None
+    if header:
+        try:
+            return max(0.0, float(header)) + RATE_LIMIT_MARGIN_S
+        except ValueError:
+            try:
+                when = parsedate_to_datetime(header).timestamp()
+                return max(0.0, when - time.time()) + RATE_LIMIT_MARGIN_S
+            except (TypeError, ValueError):
+                pass
+    wait_s = _status_wait(url)
+    if wait_s is not None:
+        return wait_s + RATE_LIMIT_MARGIN_S
+    return REQUEST_PAUSE * 2
+
+
+_REMARK_RE = re.compile(r'"remark"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+
+def _iter_json_elements(chunks: Iterable[bytes], tail: Dict[str, str]) -> Iterator[dict]:
+    """
+    Incrementally decode the objects of the top-level "elements" array of an
+    Overpass JSON answer, without ever holding the whole document.
 
+    Anything after the array is scanned for "remark", which is stored in `tail`.
+    Raises ValueError if the stream ends before the array is closed.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    pos = 0
+    state = "header"   # header → elements → trailer
+    for chunk in chunks:
+        buf += text.decode(chunk)
+        if state == "header":
+            start = re.search(r'"elements"\s*:\s*\[', buf)
+            if not start:
+                continue
+            pos, state = start.end(), "elements"
+        if state == "elements":
+            while True:
+                while pos < len(buf) and buf[pos] in " \t\r\n,":
+                    pos += 1
+                if pos >= len(buf):
+                    break
+                if buf[pos] == "]":
+                    pos, state = pos + 1, "trailer"
+                    break
+                try:
+                    element, pos = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    break  # element continues in the next chunk
+                yield element
+            buf, pos = buf[pos:], 0  # drop what has been consumed
+        if state == "trailer":
+            # The trailer is tiny; keep only enough to find "remark"
+            buf = buf[-4096:]
+    buf += text.decode(b"", final=True)
+    if state == "header":
+        data = json.loads(buf)  # no "elements" key at all (e.g. an error object)
+        tail["remark"] = data.get("remark", "")
+        return
+    if state != "trailer":
+        raise ValueError("truncated Overpass JSON")
+    match = _REMARK_RE.search(buf)
+    if match:
+        tail["remark"] = json.loads(match.group(1))
+
+
+def _post_query(
+    url: str,
+    query: str,
+    label: str,
+    cancel_event: Optional[threading.Event] = None,
+    keep: Optional[Callable[[dict], Optional[dict]]] = None,
+) -> Optional[Dict]:
+    """
+    POST one Overpass QL query to one mirror; returns {"elements", "remark"?}
+    or None on failure.
+
+    The body is parsed as a stream: each element goes through `keep` (which
+    returns a compact copy or None) and is then discarded, so memory is bounded
+    by the matching POIs rather than the response size.  A hedged request that
+    lost the race stops reading (and drops its connection) as soon as
+    cancel_event is set.  Raises RateLimited when the mirror answers 429 or
+    reports "rate_limited".
+    """
+    logger.info(f"[{label}] → {url.split('/')[2]}")
+    try:
+        with http_client.post(url, data={"data": query}, timeout=45, stream=True) as response:
+            if response.status_code == 429:
+                raise RateLimited(_rate_limit_wait(url, response))
+            response.raise_for_status()
+
+            def _chunks() -> Iterator[bytes]:
+                for chunk in response.iter_content(chunk_size=65536):
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise _Cancelled()
+                    yield chunk
+
+            tail: Dict[str, str] = {}
+            elements = []
+            for element in _iter_json_elements(_chunks(), tail):
+                if element.get("type") == COMPACT_TYPE:
+                    element = _expand_compact(element)
+                kept = keep(element) if keep else element
+                if kept is not None:
+                    elements.append(kept)
+        data: Dict = {"elements": elements}
+        if tail.get("remark"):
+            data["remark"] = tail["remark"]
+        if "rate_limited" in data.get("remark", ""):
+            raise RateLimited(_rate_limit_wait(url, None))
+        return data
+
+    except _Cancelled:
+        return None
+    except RateLimited as e:
+        logger.warning(f"[{label}] rate limited — next slot in {e.wait_s:.1f}s")
+        raise
     except requests.exceptions.ConnectionError:
         logger.warning(f"[{label}] connection error")
     except requests.exceptions.Timeout:
+        # Told apart from other failures: the scheduler retries it on another
+        # mirror once, then hands it back for the segment to be split
         logger.warning(f"[{label}] request timed out (45s)")
+        return {"elements": [], "remark": CLIENT_TIMEOUT_REMARK}
     except requests.exceptions.HTTPError as e:
         code = e.response.status_code if e.response is not None else 0
         logger.warning(f"[{label}] HTTP {code}")
@@ -64,108 +350,853 @@ def _send_query(
         logger.warning(f"[{label}] empty/invalid JSON response")
     except Exception as e:
         logger.error(f"[{label}] unexpected error: {e}")
+    return None
 
-    if retry_count < MAX_RETRIES:
-        return _send_query(query, label, retry_count + 1, cancel_check)
-    return {}
 
+# ---------------------------------------------------------------------------
+# Process-wide scheduler
+# ---------------------------------------------------------------------------
 
-def _decimate_coords(segment: LineString, max_points: int = 150) -> List[Tuple[float, float]]:
+class _TokenBucket:
+    """One request slot per `interval_s` per mirror, with a shared back-off."""
+
+    def __init__(self, interval_s: float, capacity: int = 1):
+        self.interval_s = interval_s
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        tokens = min(self.capacity, self.tokens + (now - self.updated) / self.interval_s)
+        return 0.0 if tokens >= 1.0 else (1.0 - tokens) * self.interval_s
+
+    def take(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) / self.interval_s) - 1.0
+        self.updated = now
+
+    def defer(self, seconds: float) -> None:
+        """Block this mirror for everyone, e.g. after an error or a 429."""
+        now = time.monotonic()
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0.0
+        self.updated = now
+
+
+class PendingQuery:
     """
-    Return a decimated list of (lat, lon) pairs from the segment.
-    The Overpass `around` filter uses these as the linestring waypoints.
-    Fewer points = shorter query string; 150 points per 50km segment ≈ 1 per 333m.
+    A query waiting in (or dispatched from) the scheduler queue.
+
+    `clauses` are the union statements of the query and `corridor` the area its
+    answer is expected in, so queries from several jobs can be merged into one
+    request and the returned elements handed back by corridor membership.
+    `wanted` ({tag_key: values}) lets the response be filtered while streaming.
+    `prelude` holds statements that must run before the union (see build_query).
     """
-    coords = list(segment.coords)  # (lon, lat)
-    n = len(coords)
-    if n <= max_points:
-        pts = coords
-    else:
-        step = n / max_points
-        pts = [coords[int(i * step)] for i in range(max_points)]
-        if pts[-1] != coords[-1]:
-            pts.append(coords[-1])
-    # Convert to lat,lon order required by Overpass
-    return [(c[1], c[0]) for c in pts]
 
+    def __init__(
+        self,
+        job_id: str,
+        clauses: List[str],
+        corridor: BaseGeometry,
+        wanted: Dict[str, Set[str]],
+        label: str,
+        cancel_check: Optional[Callable[[], bool]],
+        prelude: Optional[List[str]] = None,
+    ):
+        self.job_id = job_id
+        self.clauses = clauses
+        self.prelude = prelude or []
+        # Only node results have lat()/lon(), so only node queries get compact output
+        self.compact = all(_NODE_CLAUSE.match(c) for c in clauses)
+        self.corridor = corridor
+        self.wanted = wanted
+        shapely.prepare(corridor)
+        self.est_bytes = _estimate_bytes(corridor, len(clauses))
+        self.label = label
+        self.cancel_check = cancel_check
+        self.attempt = 0
+        self.rate_limit_waits = 0
+        self.tried: List[str] = []
+        self.request_s = 0.0
+        self.timed_alone = False   # request_s measured this query alone: not batched, not hedged
+        self.batchable = True
+        self.result: Dict = {}
+        self._done = threading.Event()
 
-def collect_all_types_from_segment(
-    segment: LineString,
-    type_jobs: List[dict],
-    cancel_check: Optional[Callable[[], bool]] = None,
-) -> Dict[str, Dict[tuple, dict]]:
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def finish(self, result: Dict) -> None:
+        self.result = result
+        self._done.set()
+
+    def is_cancelled(self) -> bool:
+        return bool(self.cancel_check and self.cancel_check())
+
+
+class OverpassScheduler:
     """
-    Query ALL active place types in a single Overpass request for one segment.
+    Single queue for all Overpass traffic in the process.
 
-    Uses `around` with route waypoints instead of a bounding box, so Overpass
-    only scans the actual route corridor.  Each type gets its own radius.
+    Each mirror has a token bucket (one request per OVERPASS_PAUSE), so the
+    aggregate request rate never exceeds what the mirrors allow no matter how
+    many searches run.  Jobs are served round-robin, one query per job per
+    turn, and a failed request defers its mirror for every job at once.
+    When several jobs are waiting, the head queries of other jobs ride along
+    in the same HTTP request (see _take_batch).
+    """
 
-    type_jobs: list of dicts, each with:
-        place_type, pt_config, buffer_deg, buffer_km, on_route_only
+    def __init__(self, mirrors: List[str], interval_s: float):
+        self._cond = threading.Condition()
+        self._queues: Dict[str, Deque[PendingQuery]] = {}
+        self._order: Deque[str] = deque()   # round-robin order of job ids with work
+        self._buckets = {m: _TokenBucket(interval_s) for m in mirrors}
+        self._mirrors = list(mirrors)
+        self._pool = MirrorPool(mirrors)
+        # Queries leave the fair queue only when a worker is free to send them;
+        # the executor's own FIFO queue must never fill up.
+        self._workers = max(2, len(mirrors))
+        self._busy = 0
+        self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="overpass")
+        # Separate pool for the HTTP calls themselves so hedges never wait on _execute workers
+        self._http = ThreadPoolExecutor(max_workers=2 * max(2, len(mirrors)), thread_name_prefix="overpass-http")
+        self._thread: Optional[threading.Thread] = None
 
-    Returns: {place_type: {(lat, lon, type): place_dict}}
+    def submit(
+        self,
+        job_id: str,
+        clauses: List[str],
+        corridor: BaseGeometry,
+        wanted: Dict[str, Set[str]],
+        label: str,
+        cancel_check: Optional[Callable[[], bool]] = None,
+        prelude: Optional[List[str]] = None,
+    ) -> PendingQuery:
+        pending = PendingQuery(job_id, clauses, corridor, wanted, label, cancel_check, prelude)
+        self._enqueue(pending)
+        return pending
+
+    def _enqueue(self, pending: PendingQuery, front: bool = False) -> None:
+        with self._cond:
+            queue = self._queues.setdefault(pending.job_id, deque())
+            if front:
+                queue.appendleft(pending)
+            else:
+                queue.append(pending)
+            if pending.job_id not in self._order:
+                self._order.append(pending.job_id)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._dispatch_loop, name="overpass-scheduler", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def position(self, pending: PendingQuery) -> int:
+        """1-based place in the round-robin dispatch order; 0 once dispatched."""
+        with self._cond:
+            queue = self._queues.get(pending.job_id)
+            if not queue or pending not in queue:
+                return 0
+            # Ahead of it: every job's first k queries (earlier rounds), then
+            # the k-th query of the jobs before its own in this round
+            k = queue.index(pending)
+            pos = 0
+            before = True
+            for job_id in self._order:
+                n = len(self._queues.get(job_id, ()))
+                pos += min(n, k)
+                if job_id == pending.job_id:
+                    before = False
+                elif before and n > k:
+                    pos += 1
+            return pos + 1
+
+    def cancel(self, pending: PendingQuery) -> None:
+        """Drop a query that is still queued; in-flight requests just finish unused."""
+        with self._cond:
+            queue = self._queues.get(pending.job_id)
+            if queue and pending in queue:
+                queue.remove(pending)
+        pending.finish({})
+
+    def queue_length(self) -> int:
+        with self._cond:
+            return sum(len(q) for q in self._queues.values())
+
+    def _pop_next(self) -> Optional[PendingQuery]:
+        """Take the head query of the next job in round-robin order."""
+        while self._order:
+            job_id = self._order.popleft()
+            queue = self._queues.get(job_id)
+            if not queue:
+                self._queues.pop(job_id, None)
+                continue
+            pending = queue.popleft()
+            if queue:
+                self._order.append(job_id)
+            else:
+                del self._queues[job_id]
+            if pending.is_cancelled():
+                pending.finish({})
+                continue
+            return pending
+        return None
+
+    def _take_batch(self, first: PendingQuery) -> List[PendingQuery]:
+        """Pull head queries of other jobs that fit in one request with `first`."""
+        batch = [first]
+        budget = first.est_bytes
+        for job_id in list(self._order):
+            if len(batch) >= BATCH_MAX_QUERIES or not first.batchable:
+                break
+            queue = self._queues.get(job_id)
+            if job_id == first.job_id or not queue:
+                continue
+            head = queue[0]
+            if head.is_cancelled() or not head.batchable or budget + head.est_bytes > BATCH_BUDGET_BYTES:
+                continue
+            queue.popleft()
+            if not queue:
+                del self._queues[job_id]
+                self._order.remove(job_id)
+            batch.append(head)
+            budget += head.est_bytes
+        return batch
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._order or self._busy >= self._workers:
+                    self._cond.wait()
+                now = time.monotonic()
+                waits = {m: b.wait_time(now) for m, b in self._buckets.items()}
+                ready = [m for m in self._mirrors if waits[m] <= 0]
+                if not ready:
+                    self._cond.wait(min(waits.values()))
+                    continue
+                pending = self._pop_next()
+                if pending is None:
+                    continue
+                # Healthiest ready mirror, preferring one this query has not failed on yet
+                ready = self._pool.ranked(ready)
+                fresh = [m for m in ready if m not in pending.tried]
+                mirror = (fresh or ready)[0]
+                self._buckets[mirror].take(now)
+                batch = self._take_batch(pending)
+                self._busy += 1
+            self._executor.submit(self._run, batch, mirror)
+
+    def _run(self, batch: List[PendingQuery], mirror: str) -> None:
+        try:
+            self._execute(batch, mirror)
+        finally:
+            with self._cond:
+                self._busy -= 1
+                self._cond.notify_all()
+
+    def _execute(self, batch: List[PendingQuery], mirror: str) -> None:
+        clauses: List[str] = []
+        prelude: List[str] = []
+        output_keys: List[str] = []
+        for pending in batch:
+            pending.tried.append(mirror)
+            clauses.extend(c for c in pending.clauses if c not in clauses)
+            prelude.extend(p for p in pending.prelude if p not in prelude)
+            output_keys.extend(k for k in sorted(pending.wanted) if k and k not in output_keys)
+        if not all(p.compact for p in batch):
+            output_keys = []
+        label = batch[0].label if len(batch) == 1 else f"batch of {len(batch)}: " + " | ".join(p.label for p in batch)
+
+        started = time.monotonic()
+        data, failed, hedged = self._post_hedged(
+            mirror, build_query(clauses, prelude, output_keys), label, _element_filter(batch),
+        )
+        for pending in batch:
+            pending.request_s = time.monotonic() - started
+            pending.timed_alone = len(batch) == 1 and not hedged
+        if data is not None and len(batch) > 1 and _too_large(data):
+            # Don't let one heavy query sink the others — resend them separately
+            logger.info(f"[{label}] batch too large — re-queueing its {len(batch)} queries one by one")
+            for pending in batch:
+                pending.batchable = False
+                self._enqueue(pending, front=True)
+            return
+        timed_out = _timed_out(data)
+        if data is not None and not timed_out:
+            if len(batch) == 1:
+                batch[0].finish(data)
+            else:
+                for pending, part in zip(batch, _split_by_corridor(data, batch)):
+                    pending.finish(part)
+            return
+
+        delay = REQUEST_PAUSE * (2 ** (batch[0].attempt + 1))
+        with self._cond:
+            for m, wait_s in failed.items():
+                # Rate limits hold the mirror exactly until its next slot
+                self._buckets[m].defer(wait_s if wait_s is not None else delay)
+        only_rate_limited = bool(failed) and all(w is not None for w in failed.values())
+        for pending in batch:
+            if timed_out:
+                pending.batchable = False  # a retry must not hang the other queries too
+            if pending.is_cancelled():
+                pending.finish({})
+            elif only_rate_limited and pending.rate_limit_waits < MAX_RATE_LIMIT_WAITS:
+                # Not a failure of the query itself — re-queue without using a retry
+                pending.rate_limit_waits += 1
+                pending.tried.clear()
+                self._enqueue(pending, front=True)
+            elif pending.attempt < MAX_RETRIES:
+                pending.attempt += 1
+                logger.info(f"[{pending.label}] retry {pending.attempt} queued ({mirror.split('/')[2]} paused {delay:.0f}s)")
+                self._enqueue(pending, front=True)
+            else:
+                # Timed out on the retry as well: hand back the timeout so the segment is split
+                pending.finish(data if timed_out else {})
+
+    def _try_take(self, exclude: List[str]) -> Optional[str]:
+        """Take a token from the healthiest other mirror that has one free right now."""
+        with self._cond:
+            now = time.monotonic()
+            for m in self._pool.ranked(m for m in self._mirrors if m not in exclude):
+                if self._buckets[m].wait_time(now) <= 0:
+                    self._buckets[m].take(now)
+                    return m
+        return None
+
+    def _timed_post(
+        self,
+        mirror: str,
+        query: str,
+        label: str,
+        cancel_event: threading.Event,
+        keep: Callable[[dict], Optional[dict]],
+    ) -> Tuple[Optional[Dict], Optional[float]]:
+        """
+        Returns (data, None), (None, None) on failure or (None, wait_s) when rate
+        limited.  A client timeout comes back as its stand-in answer but counts
+        as a failure of the mirror.
+        """
+        started = time.monotonic()
+        try:
+            data = _post_query(mirror, query, label, cancel_event, keep)
+        except RateLimited as e:
+            # Quota, not ill health — keep it out of the error rate
+            return None, e.wait_s
+        elapsed = time.monotonic() - started
+        if cancel_event.is_set():
+            self._pool.record_latency(mirror, elapsed)
+        else:
+            self._pool.record(mirror, data is not None and not _timed_out(data), elapsed)
+        return data, None
+
+    def _post_hedged(
+        self, primary: str, query: str, label: str, keep: Callable[[dict], Optional[dict]],
+    ) -> Tuple[Optional[Dict], Dict[str, Optional[float]], bool]:
+        """
+        Send to `primary`; if it has not answered within its p90 latency, send a
+        duplicate to the healthiest other mirror with a free slot.  The first
+        successful answer wins and the other request is cancelled.
+
+        Returns (data or None, {failed mirror: rate-limit wait or None}, whether a
+        hedge was sent); the data is the timeout stand-in (see _timed_out) if
+        every request timed out.
+        """
+        cancels: Dict[Future, threading.Event] = {}
+        mirrors: Dict[Future, str] = {}
+
+        def _start(mirror: str, tag: str) -> None:
+            event = threading.Event()
+            future = self._http.submit(self._timed_post, mirror, query, tag, event, keep)
+            cancels[future] = event
+            mirrors[future] = mirror
+
+        _start(primary, label)
+        hedge_after = self._pool.hedge_after(primary)
+        outstanding = set(cancels)
+        done, outstanding = wait(outstanding, timeout=hedge_after)
+        hedged = False
+        if not done:
+            secondary = self._try_take([primary])
+            if secondary:
+                hedged = True
+                logger.info(f"[{label}] no answer after {hedge_after:.1f}s — hedging to {secondary.split('/')[2]}")
+                _start(secondary, f"{label} (hedge)")
+                outstanding = set(cancels)
+
+        result: Optional[Dict] = None
+        cut_short: Optional[Dict] = None  # a too-large or timed-out answer, used only if nothing better arrives
+        failed: Dict[str, Optional[float]] = {}
+        finished = set(done)
+        while result is None:
+            for future in finished:
+                data, wait_s = future.result()
+                if data is None:
+                    failed[mirrors[future]] = wait_s
+                elif _timed_out(data):
+                    failed[mirrors[future]] = None
+                    cut_short = cut_short or data
+                elif _too_large(data) and outstanding:
+                    cut_short = data
+                else:
+                    result = data
+                    break
+            if result is not None or not outstanding:
+                break
+            finished, outstanding = wait(outstanding, return_when=FIRST_COMPLETED)
+
+        for future in outstanding:
+            cancels[future].set()  # loser stops reading and drops its connection
+        return result if result is not None else cut_short, failed, hedged
+
+    def health(self) -> Dict[str, dict]:
+        return self._pool.snapshot()
+
+
+def _element_filter(batch: List[PendingQuery]) -> Callable[[dict], Optional[dict]]:
     """
-    if not type_jobs:
+    Streaming filter for a (possibly batched) request: keep elements carrying a
+    wanted tag inside any member's corridor, reduced to id, coordinates, name
+    and the classifying tags.
+    """
+    wanted: Dict[str, Set[str]] = {}
+    for pending in batch:
+        for key, values in pending.wanted.items():
+            wanted.setdefault(key, set()).update(values)
+    corridor = batch[0].corridor if len(batch) == 1 else unary_union([p.corridor for p in batch])
+    shapely.prepare(corridor)
+
+    def _keep(element: dict) -> Optional[dict]:
+        lat, lon = _element_coords(element)
+        if lat is None or lon is None:
+            return None
+        kept = filter_tags(element.get("tags", {}), wanted)
+        if kept is None or not shapely.intersects_xy(corridor, lon, lat):
+            return None
+        return {"id": element.get("id"), "lat": lat, "lon": lon, "tags": kept}
+
+    return _keep
+
+
+def _split_by_corridor(data: Dict, batch: List[PendingQuery]) -> List[Dict]:
+    """Hand each batched query the returned elements that lie inside its corridor."""
+    located = []
+    for element in data.get("elements", []):
+        lat, lon = _element_coords(element)
+        if lat is not None and lon is not None:
+            located.append((element, lat, lon))
+    lons = np.array([lon for _, _, lon in located], dtype=float)
+    lats = np.array([lat for _, lat, _ in located], dtype=float)
+
+    parts = []
+    for pending in batch:
+        inside = shapely.intersects_xy(pending.corridor, lons, lats) if located else []
+        part = {"elements": [el for (el, _, _), hit in zip(located, inside) if hit]}
+        if data.get("remark"):
+            part["remark"] = data["remark"]
+        parts.append(part)
+    return parts
+
+
+SCHEDULER = OverpassScheduler(OVERPASS_MIRRORS, OVERPASS_PAUSE)
+
+
+def _send_query(
+    clauses: List[str],
+    corridor: BaseGeometry,
+    wanted: Dict[str, Set[str]],
+    label: str,
+    cancel_check: Optional[Callable[[], bool]] = None,
+    job_id: str = "default",
+    on_queue: Optional[Callable[[int], None]] = None,
+    on_request: Optional[Callable[[float], None]] = None,
+    prelude: Optional[List[str]] = None,
+    on_cost: Optional[Callable[[float], None]] = None,
+) -> Dict:
+    """
+    Send one Overpass query (union of `clauses`, after any `prelude`
+    statements) through the shared scheduler
+    and wait for it.  `corridor` bounds where its answer lies, so the query can
+    share a request with other jobs' queries; only elements inside it carrying
+    one of the `wanted` tags are kept.
+
+    on_queue is called about once a second with the current queue position
+    (0 once the request is in flight) so callers can report progress;
+    on_request receives the duration of the HTTP request itself, and on_cost
+    the same only when it measured this query alone — a request shared with
+    other jobs' queries or raced against a hedge says little about its cost.
+    """
+    if cancel_check and cancel_check():
         return {}
 
-    waypoints = _decimate_coords(segment)
-    coord_str = ",".join(f"{lat:.6f},{lon:.6f}" for lat, lon in waypoints)
+    pending = SCHEDULER.submit(job_id, clauses, corridor, wanted, label, cancel_check, prelude)
+    while not pending.wait(1.0):
+        if pending.is_cancelled():
+            SCHEDULER.cancel(pending)
+            return {}
+        if on_queue:
+            on_queue(SCHEDULER.position(pending))
+    if on_request and pending.request_s:
+        on_request(pending.request_s)
+    if on_cost and pending.request_s and pending.timed_alone:
+        on_cost(pending.request_s)
+    return pending.result
+
+
+def _simplify_corridor(
+    segment: BaseGeometry, type_jobs: List[dict],
+) -> Tuple[List[List[Tuple[float, float]]], float]:
+    """
+    Return ([(lat, lon) waypoints per line], tolerance_km) for the Overpass
+    `around` filter; a MultiLineString (route parts not covered yet) gives one
+    waypoint list per part.
+
+    The segment is simplified with Douglas–Peucker in a local metric projection,
+    which bounds the distance between the original and simplified lines by the
+    tolerance.  Padding each around radius by that tolerance therefore covers
+    the full corridor with the fewest points; exact radii are applied locally.
+    """
+    proj = LocalProjection.for_geometry(segment)
+    metric = proj.forward(segment)
+    tolerance = max(SIMPLIFY_FRACTION * min(j["buffer_km"] for j in type_jobs), MIN_SIMPLIFY_KM)
+    simplified = shapely.simplify(metric, tolerance, preserve_topology=False)
+    while shapely.get_num_coordinates(simplified) > MAX_AROUND_POINTS:
+        tolerance *= 2
+        simplified = shapely.simplify(metric, tolerance, preserve_topology=False)
+    # Convert to lat,lon order required by Overpass
+    lines = [
+        [(lat, lon) for lon, lat in part.coords]
+        for part in shapely.get_parts(proj.inverse(simplified))
+    ]
+    return lines, tolerance
+
+
+def _filter_hash(pt_config: dict) -> str:
+    """Short hash of what a place type's query asks for and how answers are classified."""
+    spec = [pt_config["query"], pt_config.get("tag_key", ""), sorted(pt_config.get("tag_values", []))]
+    return hashlib.sha1(json.dumps(spec).encode("utf-8")).hexdigest()[:8]
+
+
+def _query_cache_key(lines: List[List[Tuple[float, float]]], type_jobs: List[dict]) -> str:
+    """
+    Normalized cache key for a corridor query: sorted (type, radius, filter
+    hash) tuples plus the simplified corridor rounded to ~1 m.  The filter hash
+    covers each type's query clause and classifying tags, so editing
+    PLACE_TYPE_CONFIG invalidates old answers, while the choice of around, poly
+    or bbox filter does not.
+    """
+    norm = {
+        "types": sorted(
+            (j["place_type"], int(j["buffer_km"] * 1000), _filter_hash(j["pt_config"]))
+            + ((int(j["inner_km"] * 1000),) if "inner_km" in j else ())
+            for j in type_jobs
+        ),
+        "corridor": [[(round(lat, 5), round(lon, 5)) for lat, lon in waypoints] for waypoints in lines],
+    }
+    return hashlib.sha256(json.dumps(norm, separators=(",", ":")).encode("utf-8")).hexdigest()
 
-    # One clause per type, each with its own radius in metres
-    filter_parts = "\n".join(
-        f"  {j['pt_config']['query']}(around:{int(j['buffer_km'] * 1000)},{coord_str});"
-        for j in type_jobs
-    )
-    # timeout:60 — tell the server to allow 60s; maxsize limits memory usage
-    query = f"[out:json][timeout:60][maxsize:134217728];\n(\n{filter_parts}\n);\nout center tags;\n"
+
+def is_segment_cached(segment: BaseGeometry, type_jobs: List[dict]) -> bool:
+    """True if collect_all_types_from_segment would be answered without HTTP."""
+    if POI_BACKEND == "offline":
+        return True
+    if POI_BACKEND == "tiles":
+        return all(
+            has_tile(j["place_type"], j["pt_config"], tile)
+            for j in type_jobs
+            for tile in corridor_tiles(segment, j["buffer_km"])
+        )
+    lines, _ = _simplify_corridor(segment, type_jobs)
+    return RESPONSE_CACHE.contains(_query_cache_key(lines, type_jobs))
+
+
+def _corridor_polygon(segment: BaseGeometry, buffer_km: float) -> BaseGeometry:
+    """Segment buffered by buffer_km, using the (larger) longitude degree scale."""
+    lat0 = segment.centroid.y
+    return segment.buffer(buffer_km / (111.0 * max(math.cos(math.radians(lat0)), 0.01)))
+
+
+def _element_coords(element: dict) -> Tuple[Optional[float], Optional[float]]:
+    """Return (lat, lon) of a node, or the center of a way/relation."""
+    lat = element.get("lat")
+    lon = element.get("lon")
+    if lat is None or lon is None:
+        center = element.get("center", {})
+        lat, lon = center.get("lat"), center.get("lon")
+    return lat, lon
+
+
+def _fetch_corridor_elements(
+    segment: BaseGeometry,
+    type_jobs: List[dict],
+    cancel_check: Optional[Callable[[], bool]] = None,
+    job_id: str = "default",
+    on_queue: Optional[Callable[[int], None]] = None,
+    on_request: Optional[Callable[[float], None]] = None,
+) -> Tuple[List[dict], float]:
+    """
+    One query for all types along the segment (response-cached).  The filter —
+    around, poly or bbox — is picked by the cost model in core/query_planner.py,
+    which is fed the latency of requests that carried this query alone.
+
+    Returns (elements, fetch time) — for a cache hit, when the answer was fetched.
+    """
+    lines, tolerance_km = _simplify_corridor(segment, type_jobs)
+    plan = plan_query(lines, tolerance_km, type_jobs)
 
     label = "+".join(j["place_type"] for j in type_jobs)
     logger.info(
-        f"[{label}] Overpass around query — {len(waypoints)} waypoints, "
+        f"[{label}] Overpass {plan.strategy} query (est. {plan.estimate_s:.1f}s) — "
+        f"{sum(len(w) for w in lines)} waypoints in {len(lines)} line(s) "
+        f"({shapely.get_num_coordinates(segment)} in segment, tolerance {tolerance_km * 1000:.0f}m), "
         f"{len(type_jobs)} types, radii: "
-        + ", ".join(f"{j['place_type']}={int(j['buffer_km']*1000)}m" for j in type_jobs)
+        + ", ".join(
+            f"{j['place_type']}={int(j['buffer_km']*1000)}m"
+            + (f" beyond {int(j['inner_km']*1000)}m" if "inner_km" in j else "")
+            for j in type_jobs
+        )
+    )
+
+    cache_key = _query_cache_key(lines, type_jobs)
+    cached = RESPONSE_CACHE.get_entry(cache_key)
+    if cached is not None:
+        logger.info(f"[{label}] cache hit — {len(cached[0])} elements")
+        return cached
+
+    corridor = _corridor_polygon(segment, max(j["buffer_km"] for j in type_jobs))
+    costs: List[float] = []
+    fetched_at = time.time()
+    data = _send_query(
+        plan.clauses, corridor, _wanted_tags(type_jobs), label, cancel_check, job_id, on_queue, on_request,
+        plan.prelude, costs.append,
+    )
+    # A client timeout only bounds the cost from below, so it is no sample either
+    if costs and "elements" in data and not _timed_out(data):
+        COST_MODEL.record(plan.strategy, plan.work, costs[-1])
+    if _timed_out(data):
+        raise QueryTimedOut(f"[{label}] {data['remark']}")
+    if _too_large(data):
+        raise QueryTooLarge(f"[{label}] {data['remark']}")
+    if "elements" not in data:
+        raise QueryFailed(f"[{label}] no answer from any Overpass mirror")
+    logger.info(f"[{label}] received {len(data['elements'])} elements")
+    # Only cache complete answers — a "remark" means the server aborted mid-query
+    if not data.get("remark"):
+        RESPONSE_CACHE.put(cache_key, data["elements"])
+    return data["elements"], fetched_at
+
+
+def _fetch_tile_elements(
+    segment: BaseGeometry,
+    type_jobs: List[dict],
+    cancel_check: Optional[Callable[[], bool]] = None,
+    job_id: str = "default",
+    on_queue: Optional[Callable[[int], None]] = None,
+    on_request: Optional[Callable[[float], None]] = None,
+) -> Tuple[List[dict], float]:
+    """
+    Load every (type, tile) covering the corridor from the tile store, fetching
+    only the missing ones from Overpass in bbox batches of TILE_BATCH tiles.
+
+    Returns (elements, fetch time of the oldest tile used).
+    """
+    needed = {j["place_type"]: corridor_tiles(segment, j["buffer_km"]) for j in type_jobs}
+    jobs_by_type = {j["place_type"]: j for j in type_jobs}
+
+    elements: List[dict] = []
+    fetched_at = time.time()
+    missing: Dict[Tile, List[str]] = {}  # tile → place types still to fetch
+    for place_type, tiles in needed.items():
+        pt_config = jobs_by_type[place_type]["pt_config"]
+        for tile in tiles:
+            stored = load_tile(place_type, pt_config, tile)
+            if stored is None:
+                missing.setdefault(tile, []).append(place_type)
+            else:
+                elements.extend(stored[0])
+                fetched_at = min(fetched_at, stored[1])
+
+    n_tiles = sum(len(t) for t in needed.values())
+    logger.info(
+        f"Tile store: {n_tiles - sum(len(v) for v in missing.values())}/{n_tiles} "
+        f"(type, tile) pairs stored, {len(missing)} tile(s) to fetch"
     )
 
-    data = _send_query(query, label, cancel_check=cancel_check)
-    n_elements = len(data.get("elements", []))
-    logger.info(f"[{label}] received {n_elements} elements")
+    pending = sorted(missing.items())
+    for i in range(0, len(pending), TILE_BATCH):
+        if cancel_check and cancel_check():
+            break
+        batch = pending[i:i + TILE_BATCH]
+        clauses = []
+        for tile, place_types in batch:
+            s, w, n, e = tile_bounds(tile)
+            for place_type in place_types:
+                query_part = jobs_by_type[place_type]["pt_config"]["query"]
+                clauses.append(f"  {query_part}({s:.6f},{w:.6f},{n:.6f},{e:.6f});")
+        corridor = unary_union([box(w, s, e, n) for s, w, n, e in (tile_bounds(t) for t, _ in batch)])
+        label = f"tiles {i + 1}-{i + len(batch)}/{len(pending)}"
+        data = _send_query(clauses, corridor, _wanted_tags(type_jobs), label, cancel_check, job_id, on_queue, on_request)
+        if "elements" not in data or data.get("remark"):
+            # These tiles stay missing so a later search retries them
+            raise QueryFailed(f"[{label}] {data.get('remark') or 'no answer from any Overpass mirror'}")
+
+        fetched = []
+        for element in data["elements"]:
+            lat, lon = _element_coords(element)
+            if lat is not None and lon is not None:
+                fetched.append({"lat": lat, "lon": lon, "tags": element.get("tags", {})})
+        by_tile = group_by_tile(fetched)
+        for tile, place_types in batch:
+            in_tile = by_tile.get(tile, [])
+            for place_type in place_types:
+                pt_config = jobs_by_type[place_type]["pt_config"]
+                matching = [
+                    el for el in in_tile
+                    if el["tags"].get(pt_config.get("tag_key", "")) in pt_config.get("tag_values", [])
+                ]
+                store_tile(place_type, pt_config, tile, matching)
+                elements.extend(matching)
+        logger.info(f"[{label}] received {len(fetched)} elements")
+
+    return elements, fetched_at
+
+
+def _wanted_tags(type_jobs: List[dict]) -> Dict[str, Set[str]]:
+    """{tag_key: {tag_values}} for the requested place types."""
+    wanted: Dict[str, Set[str]] = {}
+    for job in type_jobs:
+        pt_config = job["pt_config"]
+        wanted.setdefault(pt_config.get("tag_key", ""), set()).update(pt_config.get("tag_values", []))
+    return wanted
+
+
+def _tag_lookup(type_jobs: List[dict]) -> Dict[Tuple[str, str], List[int]]:
+    """{(tag_key, tag_value): [type_jobs indices in priority order]}."""
+    lookup: Dict[Tuple[str, str], List[int]] = {}
+    for idx, job in enumerate(type_jobs):
+        pt_config = job["pt_config"]
+        for value in pt_config.get("tag_values", []):
+            lookup.setdefault((pt_config.get("tag_key", ""), value), []).append(idx)
+    return lookup
+
 
+def _classify_elements(
+    elements: List[dict],
+    segment: BaseGeometry,
+    type_jobs: List[dict],
+    fetched_at: float,
+) -> Dict[str, Dict[tuple, dict]]:
+    """
+    Assign elements to place types and keep those within each type's radius.
+    Each place is stamped with `fetched_at`, when its POI data was fetched.
+
+    Tags are matched through a precompiled (key, value) lookup.  Distances are
+    computed in one vectorized call in a local metric projection, against the
+    segment simplified by CLASSIFY_TOLERANCE_KM; only candidates that close to
+    a radius are measured against the full segment, so the radius test stays
+    exact while a long GPS track costs little more than its simplified line.
+    An element belongs to the first type (in type_jobs order) whose tag it
+    carries and whose radius it falls within.
+    """
     results: Dict[str, Dict[tuple, dict]] = {j["place_type"]: {} for j in type_jobs}
+    lookup = _tag_lookup(type_jobs)
+    tag_keys = {key for key, _ in lookup}
 
-    for element in data.get("elements", []):
-        lat = element.get("lat")
-        lon = element.get("lon")
-        if lat is None or lon is None:
-            center = element.get("center", {})
-            lat, lon = center.get("lat"), center.get("lon")
+    candidates: List[Tuple[float, float, dict, List[int]]] = []
+    for element in elements:
+        lat, lon = _element_coords(element)
         if lat is None or lon is None:
             continue
-
         tags = element.get("tags", {})
-        pt = Point(lon, lat)
-
-        for job in type_jobs:
-            place_type = job["place_type"]
-            pt_config = job["pt_config"]
+        job_idxs: List[int] = []
+        for key in tag_keys:
+            value = tags.get(key)
+            if value is not None:
+                job_idxs.extend(lookup.get((key, value), ()))
+        if job_idxs:
+            candidates.append((lat, lon, tags, sorted(job_idxs)))
+    if not candidates:
+        return results
 
-            if tags.get(pt_config.get("tag_key", "")) not in pt_config.get("tag_values", []):
-                continue
+    lats = np.fromiter((c[0] for c in candidates), dtype=float, count=len(candidates))
+    lons = np.fromiter((c[1] for c in candidates), dtype=float, count=len(candidates))
+    dists = LocalProjection.for_geometry(segment).distances_km(
+        segment, lons, lats, CLASSIFY_TOLERANCE_KM, [j["buffer_km"] for j in type_jobs],
+    )
 
-            # Precise Shapely distance check (more accurate than the around pre-filter)
-            dist_km = segment.distance(pt) * 111.0
+    for (lat, lon, tags, job_idxs), dist_km in zip(candidates, dists):
+        for idx in job_idxs:
+            job = type_jobs[idx]
             if dist_km > job["buffer_km"]:
                 continue
-
+            place_type = job["place_type"]
             key = (lat, lon, place_type)
             if key not in results[place_type]:
-                base_name = tags.get("name", f"Unnamed {pt_config.get('name', 'Place')}")
+                pt_config = job["pt_config"]
                 results[place_type][key] = {
-                    "base_name": base_name,
+                    "base_name": tags.get("name", f"Unnamed {pt_config.get('name', 'Place')}"),
                     "lat": lat,
                     "lon": lon,
+                    "distance_km": round(float(dist_km), 3),
                     "place_type": place_type,
+                    "fetched_at": fetched_at,
                     "config": pt_config,
                 }
             break  # each element belongs to at most one type
-
     return results
+
+
+def collect_all_types_from_segment(
+    segment: BaseGeometry,
+    type_jobs: List[dict],
+    cancel_check: Optional[Callable[[], bool]] = None,
+    job_id: str = "default",
+    on_queue: Optional[Callable[[int], None]] = None,
+    on_request: Optional[Callable[[float], None]] = None,
+    on_fetched: Optional[Callable[[float], None]] = None,
+) -> Dict[str, Dict[tuple, dict]]:
+    """
+    Query ALL active place types in a single Overpass request for one segment.
+
+    Queries only the route corridor — with an `around`, `poly` or bbox filter,
+    whichever the query planner expects to be cheapest.  Each type gets its
+    own radius.
+    With POI_BACKEND = "tiles" the corridor is served from the per-tile store
+    instead, fetching only tiles that have not been seen before; with
+    "offline" it is answered from the local OSM extract index.
+
+    segment: a LineString, or a MultiLineString of route parts still to query
+    type_jobs: list of dicts, each with:
+        place_type, pt_config, buffer_deg, buffer_km, on_route_only, and
+        optionally inner_km — POIs that close are known, query only the ring
+    job_id / on_queue / on_request: identify the search in SCHEDULER, receive
+        its queue position while waiting and the duration of each Overpass
+        request (see _send_query).
+    on_fetched: receives when the answer's POI data was fetched — earlier
+        than now when it came from the response cache or tile store.
+
+    Returns: {place_type: {(lat, lon, type): place_dict}}
+    Raises QueryTooLarge when the server cut the query short (timeout or
+    maxsize), QueryTimedOut when no mirror answered in time, and
+    QueryFailed when no mirror answered.
+    """
+    if not type_jobs:
+        return {}
+
+    if POI_BACKEND == "offline":
+        buffer_km = max(j["buffer_km"] for j in type_jobs)
+        elements = [el for part in shapely.get_parts(segment) for el in get_index().query_corridor(part, buffer_km)]
+        fetched_at = time.time()
+    elif POI_BACKEND == "tiles":
+        elements, fetched_at = _fetch_tile_elements(segment, type_jobs, cancel_check, job_id, on_queue, on_request)
+    else:
+        elements, fetched_at = _fetch_corridor_elements(
+            segment, type_jobs, cancel_check, job_id, on_queue, on_request,
+        )
+    if on_fetched:
+        on_fetched(fetched_at)
+
+    return _classify_elements(elements, segment, type_jobs, fetched_at)
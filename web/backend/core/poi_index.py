@@ -0,0 +1,192 @@
+"""
+Local POI index — a SQLite R*Tree over OSM nodes relevant to PLACE_TYPE_CONFIG.
+
+Filled by core/osm_import.py from an OSM extract, then queried per route
+segment by the "offline" POI backend in core/overpass.py.  Only coordinates,
+the name and the classifying tags are stored, so a country extract stays small.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from shapely.geometry import LineString
+from shapely.ops import substring
+
+from .cache import CACHE_DIR
+from .place_types import PLACE_TYPE_CONFIG
+
+POI_INDEX_PATH = Path(os.environ.get("TRACKWISE_POI_INDEX", CACHE_DIR / "poi_index.sqlite"))
+QUERY_PIECE_KM = 5.0  # corridor is queried as bboxes around ~5 km route pieces
+
+
+def relevant_tags() -> Dict[str, Set[str]]:
+    """{tag_key: {tag_values}} for every place type — the only tags worth indexing."""
+    tags: Dict[str, Set[str]] = {}
+    for cfg in PLACE_TYPE_CONFIG.values():
+        tags.setdefault(cfg["tag_key"], set()).update(cfg["tag_values"])
+    return tags
+
+
+def filter_tags(tags: Dict[str, str], wanted: Dict[str, Set[str]]) -> Optional[Dict[str, str]]:
+    """Return only the name + matching classifying tags, or None if nothing matches."""
+    kept = {k: v for k, v in tags.items() if v in wanted.get(k, ())}
+    if not kept:
+        return None
+    if "name" in tags:
+        kept["name"] = tags["name"]
+    return kept
+
+
+class PoiIndex:
+    """SQLite table of POI nodes plus an R*Tree on their coordinates."""
+
+    def __init__(self, path: Path = POI_INDEX_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS pois (
+                osm_id INTEGER PRIMARY KEY,
+                lat REAL NOT NULL,
+                lon REAL NOT NULL,
+                tags TEXT NOT NULL
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS pois_rtree USING rtree(
+                osm_id, min_lat, max_lat, min_lon, max_lon
+            );
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            """
+        )
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+    # ---- writes -----------------------------------------------------------
+
+    def upsert_many(self, rows: Iterable[Tuple[int, float, float, Dict[str, str]]]) -> int:
+        """Insert or replace (osm_id, lat, lon, tags) rows; returns the row count."""
+        n = 0
+        with self._lock:
+            cur = self._conn.cursor()
+            for osm_id, lat, lon, tags in rows:
+                cur.execute(
+                    "INSERT OR REPLACE INTO pois (osm_id, lat, lon, tags) VALUES (?, ?, ?, ?)",
+                    (osm_id, lat, lon, json.dumps(tags, separators=(",", ":"))),
+                )
+                cur.execute(
+                    "INSERT OR REPLACE INTO pois_rtree (osm_id, min_lat, max_lat, min_lon, max_lon) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (osm_id, lat, lat, lon, lon),
+                )
+                n += 1
+            self._conn.commit()
+        return n
+
+    def delete_many(self, osm_ids: Iterable[int]) -> int:
+        """Delete nodes by id; returns how many were actually present."""
+        n = 0
+        with self._lock:
+            cur = self._conn.cursor()
+            for osm_id in osm_ids:
+                cur.execute("DELETE FROM pois WHERE osm_id = ?", (osm_id,))
+                n += cur.rowcount
+                cur.execute("DELETE FROM pois_rtree WHERE osm_id = ?", (osm_id,))
+            self._conn.commit()
+        return n
+
+    def set_meta(self, key: str, value: str) -> None:
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+            self._conn.commit()
+
+    def get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def existing(self, osm_ids: List[int]) -> Set[int]:
+        """The subset of `osm_ids` present in the index."""
+        found: Set[int] = set()
+        with self._lock:
+            for i in range(0, len(osm_ids), 500):  # stay under SQLite's bound-parameter limit
+                chunk = osm_ids[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT osm_id FROM pois WHERE osm_id IN ({','.join('?' * len(chunk))})", chunk,
+                ).fetchall()
+                found.update(row[0] for row in rows)
+        return found
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pois").fetchone()[0]
+
+    # ---- reads ------------------------------------------------------------
+
+    def query_bbox(self, south: float, west: float, north: float, east: float) -> List[dict]:
+        """Return elements {"id", "lat", "lon", "tags"} inside a bounding box."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT p.osm_id, p.lat, p.lon, p.tags FROM pois_rtree r "
+                "JOIN pois p ON p.osm_id = r.osm_id "
+                "WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?",
+                (south, north, west, east),
+            ).fetchall()
+        return [
+            {"id": osm_id, "lat": lat, "lon": lon, "tags": json.loads(tags)}
+            for osm_id, lat, lon, tags in rows
+        ]
+
+    def query_corridor(self, segment: LineString, buffer_km: float) -> List[dict]:
+        """
+        Return all indexed POIs within roughly buffer_km of the segment.
+
+        The segment is cut into ~QUERY_PIECE_KM pieces and each piece's buffered
+        bbox is looked up in the R*Tree, so a diagonal segment does not scan a
+        huge square.  Callers apply the exact per-type distance check.
+        """
+        lat0 = segment.centroid.y
+        km_per_deg_lon = 111.0 * max(math.cos(math.radians(lat0)), 0.01)
+        pad_lat = buffer_km / 111.0
+        pad_lon = buffer_km / km_per_deg_lon
+
+        length_deg = segment.length
+        approx_km = length_deg * 111.0
+        n_pieces = max(1, int(math.ceil(approx_km / QUERY_PIECE_KM)))
+
+        found: Dict[int, dict] = {}
+        for i in range(n_pieces):
+            piece = substring(segment, length_deg * i / n_pieces, length_deg * (i + 1) / n_pieces)
+            min_lon, min_lat, max_lon, max_lat = piece.bounds
+            for el in self.query_bbox(min_lat - pad_lat, min_lon - pad_lon, max_lat + pad_lat, max_lon + pad_lon):
+                found[el["id"]] = el
+        return list(found.values())
+
+
+_INDEX: Optional[PoiIndex] = None
+_INDEX_LOCK = threading.Lock()
+
+
+def get_index() -> PoiIndex:
+    """Open the shared index at POI_INDEX_PATH on first use."""
+    global _INDEX
+    with _INDEX_LOCK:
+        if _INDEX is None:
+            if not POI_INDEX_PATH.exists():
+                raise RuntimeError(
+                    f"Offline POI index not found at {POI_INDEX_PATH} — "
+                    "build it with: python -m core.osm_import <extract.osm.pbf>"
+                )
+            _INDEX = PoiIndex(POI_INDEX_PATH)
+        return _INDEX
+
@@ -0,0 +1,278 @@
+"""
+Overpass query planner — picks the cheapest filter for a route corridor.
+
+Overpass evaluates the same corridor very differently depending on how it is
+expressed:
+
+  around  distance check against the route linestring; cost grows with the
+          corridor area and the number of route points
+  poly    point-in-polygon on the buffered corridor; cost grows with the
+          polygon's bounding box and vertex count, so it suits straight,
+          axis-aligned stretches
+  bbox    a few tight boxes along the route; the cheapest filter per element,
+          but every box returns some POIs outside the corridor
+
+Each strategy's cost is modelled as seconds = intercept + slope * work, where
+`work` is a strategy-specific size measure of the query.  Observed latencies
+update the coefficients (exponentially weighted least squares), persisted in
+COST_STORE so the model keeps calibrating across restarts.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import math
+import random
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import shapely
+from shapely.geometry import MultiLineString
+from shapely.ops import substring
+
+from .cache import CACHE_DIR, SqliteCache
+from .geo import LocalProjection
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ("around", "poly", "bbox")
+# Prior (intercept_s, slope_s_per_work) used until a strategy has enough samples
+PRIOR_COSTS: Dict[str, Tuple[float, float]] = {
+    "around": (1.0, 0.004),
+    "poly": (1.0, 0.005),
+    "bbox": (1.0, 0.006),
+}
+MIN_SAMPLES = 5           # samples before a strategy's own fit replaces its prior
+SAMPLE_DECAY = 0.97       # weight kept by older samples on each new one
+EXPLORE_RATE = 0.1        # chance of trying an under-sampled strategy instead of the cheapest
+BBOX_PIECE_KM = 5.0       # route length covered by one box of the bbox strategy
+MAX_POLY_VERTICES = 400   # larger polygons make Overpass' poly parser slow; skip the strategy
+COST_STORE = SqliteCache(CACHE_DIR / "query_costs.sqlite", 365 * 24 * 3600, 1024 * 1024)
+
+
+class QueryPlan:
+    """Chosen strategy for one corridor query, with its prelude and union clauses."""
+
+    def __init__(self, strategy: str, prelude: List[str], clauses: List[str], work: float, estimate_s: float):
+        self.strategy = strategy
+        self.prelude = prelude
+        self.clauses = clauses
+        self.work = work
+        self.estimate_s = estimate_s
+
+
+# ---------------------------------------------------------------------------
+# Cost model
+# ---------------------------------------------------------------------------
+
+class CostModel:
+    """Per-strategy linear latency model, calibrated from observed requests; thread-safe."""
+
+    def __init__(self, store: SqliteCache = COST_STORE):
+        self._store = store
+        self._lock = threading.Lock()
+
+    def _state(self, strategy: str) -> Dict[str, float]:
+        return self._store.get(strategy) or {"n": 0.0, "sx": 0.0, "sy": 0.0, "sxx": 0.0, "sxy": 0.0}
+
+    def coefficients(self, strategy: str) -> Tuple[float, float]:
+        """(intercept_s, slope) — the prior until MIN_SAMPLES observations exist."""
+        with self._lock:
+            st = self._state(strategy)
+        prior = PRIOR_COSTS[strategy]
+        if st["n"] < MIN_SAMPLES:
+            return prior
+        mean_x, mean_y = st["sx"] / st["n"], st["sy"] / st["n"]
+        var_x = st["sxx"] / st["n"] - mean_x ** 2
+        if var_x <= 1e-9 * max(mean_x ** 2, 1.0):
+            # All samples had about the same size: keep the prior intercept, fit the slope
+            slope = max(mean_y - prior[0], 0.0) / mean_x if mean_x > 0 else prior[1]
+            return prior[0], slope
+        slope = max((st["sxy"] / st["n"] - mean_x * mean_y) / var_x, 0.0)
+        return max(mean_y - slope * mean_x, 0.0), slope
+
+    def estimate(self, strategy: str, work: float) -> float:
+        intercept, slope = self.coefficients(strategy)
+        return intercept + slope * work
+
+    def samples(self, strategy: str) -> float:
+        with self._lock:
+            return self._state(strategy)["n"]
+
+    def record(self, strategy: str, work: float, seconds: float) -> None:
+        """Add one observed request latency for a query of the given work."""
+        with self._lock:
+            st = self._state(strategy)
+            for key in st:
+                st[key] *= SAMPLE_DECAY
+            st["n"] += 1.0
+            st["sx"] += work
+            st["sy"] += seconds
+            st["sxx"] += work * work
+            st["sxy"] += work * seconds
+            self._store.put(strategy, st)
+
+    def snapshot(self) -> Dict[str, dict]:
+        out = {}
+        for strategy in STRATEGIES:
+            intercept, slope = self.coefficients(strategy)
+            out[strategy] = {
+                "intercept_s": round(intercept, 3),
+                "slope_s": round(slope, 6),
+                "samples": round(self.samples(strategy), 1),
+            }
+        return out
+
+
+COST_MODEL = CostModel()
+
+
+# ---------------------------------------------------------------------------
+# Candidate queries
+# ---------------------------------------------------------------------------
+#
+# Each strategy yields corridor filters at the largest radius (plus the
+# simplification tolerance).  With several types the corridor is evaluated once
+# into a named set and each type's tag filter is applied to that set, so the
+# route coordinates are sent — and the corridor built — only once; the exact
+# per-type radii are applied locally.
+
+_QUERY_RE = re.compile(r"^(node|way|relation|nwr|nw|nr|wr)(\[.*\])$")
+
+
+def _split_query(query: str) -> Optional[Tuple[str, str]]:
+    """'node["amenity"="fuel"]' → ('node', '["amenity"="fuel"]'), or None if not that simple form."""
+    match = _QUERY_RE.match(query.strip())
+    return (match.group(1), match.group(2)) if match else None
+
+
+def _assemble(
+    filters: List[str], type_jobs: List[dict], inner_filters: Optional[List[str]] = None,
+) -> Tuple[List[str], List[str]]:
+    """
+    Return (prelude, clauses) querying every type inside the corridor `filters`.
+    With `inner_filters` only the ring outside them is returned (a difference
+    against the inner corridor, whose POIs are already known).
+    """
+    parsed = [_split_query(j["pt_config"]["query"]) for j in type_jobs]
+    if len(type_jobs) == 1 or any(p is None for p in parsed):
+        prelude: List[str] = []
+        clauses = [f"  {j['pt_config']['query']}{f};" for j in type_jobs for f in filters]
+        inner = [f"{j['pt_config']['query']}{f};" for j in type_jobs for f in inner_filters or []]
+    else:
+        element_types = {element_type for element_type, _ in parsed}
+        corridor_type = element_types.pop() if len(element_types) == 1 else "nwr"
+        keys = sorted({j["pt_config"]["tag_key"] for j in type_jobs})
+        key_filter = f'[~"^({"|".join(keys)})$"~"."]'
+        corridor = " ".join(f"{corridor_type}{key_filter}{f};" for f in filters)
+        # Named after its content so identical corridors in a batched request share one set
+        set_name = "c" + hashlib.sha1(corridor.encode("utf-8")).hexdigest()[:10]
+        prelude = [f"({corridor})->.{set_name};"]
+        clauses = list(dict.fromkeys(f"  {element_type}.{set_name}{tags};" for element_type, tags in parsed))
+        inner = [f"{corridor_type}{key_filter}{f};" for f in inner_filters or []]
+
+    if inner:
+        inner_body = " ".join(inner)
+        inner_name = "i" + hashlib.sha1(inner_body.encode("utf-8")).hexdigest()[:10]
+        prelude.append(f"({inner_body})->.{inner_name};")
+        clauses = [f"  ({clause.strip()[:-1]}; - .{inner_name};);" for clause in clauses]
+    return prelude, clauses
+
+
+def _max_radius_km(type_jobs: List[dict], tolerance_km: float) -> float:
+    return max(j["buffer_km"] for j in type_jobs) + tolerance_km
+
+
+def _around(lines: List[List[Tuple[float, float]]], radius_km: float,
+            metric: MultiLineString) -> Tuple[List[str], float]:
+    filters = [
+        f"(around:{math.ceil(radius_km * 1000)},{','.join(f'{lat:.6f},{lon:.6f}' for lat, lon in waypoints)})"
+        for waypoints in lines
+    ]
+    work = metric.buffer(radius_km).area * (1 + shapely.get_num_coordinates(metric) / 100)
+    return filters, work
+
+
+def _poly(proj: LocalProjection, radius_km: float, tolerance_km: float,
+          metric: MultiLineString) -> Optional[Tuple[List[str], float]]:
+    filters: List[str] = []
+    work = 0.0
+    # Simplify the outline outwards-safe: buffer by the extra tolerance first
+    outline = metric.buffer(radius_km + tolerance_km).simplify(tolerance_km)
+    for polygon in shapely.get_parts(outline):
+        ring = polygon.exterior  # holes dropped — a superset is fine
+        if len(ring.coords) > MAX_POLY_VERTICES:
+            return None
+        lons, lats = proj.to_lonlat(*ring.xy)
+        poly_str = " ".join(f"{lat:.6f} {lon:.6f}" for lat, lon in zip(lats[:-1], lons[:-1]))
+        filters.append(f'(poly:"{poly_str}")')
+        min_x, min_y, max_x, max_y = ring.bounds
+        work += (max_x - min_x) * (max_y - min_y) * (1 + len(ring.coords) / 100)
+    return filters, work
+
+
+def _bbox(proj: LocalProjection, radius_km: float, metric: MultiLineString) -> Tuple[List[str], float]:
+    filters: List[str] = []
+    work = 0.0
+    for line in shapely.get_parts(metric):
+        n = max(1, math.ceil(line.length / BBOX_PIECE_KM))
+        for i in range(n):
+            piece = substring(line, line.length * i / n, line.length * (i + 1) / n)
+            min_x, min_y, max_x, max_y = piece.bounds
+            (w, e), (s, n_) = proj.to_lonlat([min_x - radius_km, max_x + radius_km],
+                                              [min_y - radius_km, max_y + radius_km])
+            filters.append(f"({s:.6f},{w:.6f},{n_:.6f},{e:.6f})")
+            work += (max_x - min_x + 2 * radius_km) * (max_y - min_y + 2 * radius_km)
+    return filters, work
+
+
+def plan_query(
+    lines: List[List[Tuple[float, float]]],
+    tolerance_km: float,
+    type_jobs: List[dict],
+    model: CostModel = COST_MODEL,
+) -> QueryPlan:
+    """
+    Build the around, poly and bbox variants of a corridor query and return the
+    one with the lowest estimated latency.  `lines` are the simplified (lat, lon)
+    route lines and `tolerance_km` their simplification tolerance; every
+    variant covers the largest radius plus the tolerance.
+
+    Now and then an under-sampled strategy is chosen instead, so its cost
+    estimate gets calibrated too.
+
+    When every type job carries "inner_km" (POIs that close to the route are
+    already known), the query returns only the ring beyond it.
+    """
+    route = MultiLineString([[(lon, lat) for lat, lon in waypoints] for waypoints in lines])
+    proj = LocalProjection.for_geometry(route)
+    metric = proj.forward(route)
+
+    radius_km = _max_radius_km(type_jobs, tolerance_km)
+
+    candidates: Dict[str, Tuple[List[str], float]] = {"around": _around(lines, radius_km, metric)}
+    poly = _poly(proj, radius_km, tolerance_km, metric)
+    if poly is not None:
+        candidates["poly"] = poly
+    candidates["bbox"] = _bbox(proj, radius_km, metric)
+
+    estimates = {s: model.estimate(s, work) for s, (_, work) in candidates.items()}
+    strategy = min(estimates, key=estimates.get)
+    under_sampled = [s for s in candidates if s != strategy and model.samples(s) < MIN_SAMPLES]
+    if under_sampled and random.random() < EXPLORE_RATE:
+        strategy = random.choice(under_sampled)
+        logger.info(f"Query planner: exploring '{strategy}' (est. {estimates[strategy]:.1f}s)")
+
+    filters, work = candidates[strategy]
+    # Ring query: POIs within inner_km of the route are known already.  The
+    # inner corridor must not reach past the known one, so it is always an
+    # `around` shrunk by the simplification tolerance.
+    inner_filters = None
+    if all("inner_km" in j for j in type_jobs):
+        inner_km = min(j["inner_km"] for j in type_jobs) - tolerance_km
+        if inner_km > 0:
+            inner_filters, _ = _around(lines, inner_km, metric)
+    prelude, clauses = _assemble(filters, type_jobs, inner_filters)
+    return QueryPlan(strategy, prelude, clauses, work, estimates[strategy])
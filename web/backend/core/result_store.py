@@ -0,0 +1,252 @@
+"""
+Content-addressed store of finished search results.
+
+A result is keyed by a hash of what determines it: the route geometry, the
+place types with their radii, and the data version (POI backend, offline index
+revision, place-type queries, result format).  Resubmitting the same GPX with
+the same settings — minutes or days later, across restarts — is answered from
+disk without a single Overpass or routing request.
+
+Entries expire with the age of the POI data they were built from
+(RESULT_STORE_TTL_S) and the store is held to RESULT_STORE_MAX_BYTES,
+least recently used results evicted first.
+
+Exact hashing misses a friend's own recording of the same ride, so each
+finished search also leaves its route and raw per-type POIs in ROUTE_INDEX,
+findable through a coarse grid fingerprint of the route.  find_similar_routes
+returns earlier searches whose corridor covers part of a new route; their
+POIs are reused and only the stretches they do not cover are queried.  POIs
+are kept at the radius they were fetched with, so a later search with a
+smaller radius filters them locally and a larger one only queries the ring
+beyond it.  Each keeps the time it was first fetched, however often it is
+reused, and an index record expires with its oldest POI data.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import math
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import shapely
+from shapely.geometry import LineString
+
+from .cache import CACHE_DIR, SqliteCache
+from .geo import LocalProjection
+from .overpass import POI_BACKEND, RESPONSE_CACHE_TTL_S
+from .place_types import PLACE_TYPE_CONFIG
+from .poi_index import get_index
+from .segmenter import OVERLAP_PAD_KM
+
+logger = logging.getLogger(__name__)
+
+RESULT_FORMAT = 6   # bump when the result payload changes shape
+# A stored result is as old as the oldest POI answer it was built from: its
+# entry is dated from that answer's fetch time ("fetched_at"), so it expires
+# with the data rather than a full TTL after the search.
+RESULT_STORE_TTL_S = RESPONSE_CACHE_TTL_S
+RESULT_STORE_MAX_BYTES = 100 * 1024 * 1024
+RESULT_STORE = SqliteCache(CACHE_DIR / "results.sqlite", RESULT_STORE_TTL_S, RESULT_STORE_MAX_BYTES)
+ROUTE_DECIMALS = 6  # ~0.1 m; finer differences are GPS noise, not another route
+
+# Near-duplicate routes: grid-cell fingerprint → earlier searches, then an exact
+# distance check.  Another recording counts as the same road where it stays
+# within OVERLAP_PAD_KM, the padding every corridor query already carries.
+ROUTE_INDEX = SqliteCache(CACHE_DIR / "route_index.sqlite", RESULT_STORE_TTL_S, 200 * 1024 * 1024)
+FINGERPRINT_CELL_DEG = 0.05    # ~5 km cells
+FINGERPRINT_SAMPLE_KM = 0.5    # route sampled this often, for cells and the distance check
+MIN_SHARED_CELLS = 0.2         # share of the new route's cells an earlier route must touch
+MIN_COVERED_SHARE = 0.1        # reuse an earlier search only if it covers this much of the route
+MAX_MATCH_CANDIDATES = 5       # earlier searches checked in detail, most shared cells first
+MAX_ROUTES_PER_CELL = 50       # freshest data kept in each cell's posting list
+
+
+def data_version() -> str:
+    """Identify the POI data and code a result was computed from."""
+    parts = [str(RESULT_FORMAT), POI_BACKEND]
+    if POI_BACKEND == "offline":
+        try:
+            index = get_index()
+            parts.append(index.get_meta("updated_at") or index.get_meta("imported_at") or "")
+        except RuntimeError:
+            parts.append("")
+    queries = sorted((pt, cfg["query"]) for pt, cfg in PLACE_TYPE_CONFIG.items())
+    parts.append(hashlib.sha1(json.dumps(queries).encode("utf-8")).hexdigest()[:12])
+    return ":".join(parts)
+
+
+def result_key(route_points: List[Tuple[float, float]], place_types: Dict[str, float]) -> str:
+    """Hash of (route geometry, place types + radii, data version)."""
+    payload = json.dumps(
+        {
+            "route": [[round(lon, ROUTE_DECIMALS), round(lat, ROUTE_DECIMALS)] for lon, lat in route_points],
+            "types": sorted((pt, float(km)) for pt, km in place_types.items()),
+            "data": data_version(),
+        },
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def load_result(key: str) -> Optional[dict]:
+    """Return the stored result payload ({"places", "route_points", "total_km", ...}) or None."""
+    return RESULT_STORE.get(key)
+
+
+def save_result(key: str, result: dict) -> None:
+    """Store a finished result, expiring RESULT_STORE_TTL_S after its oldest POI data was fetched."""
+    RESULT_STORE.put(key, result, created_at=result["fetched_at"])
+    logger.info(f"Stored search result {key[:12]} ({len(result.get('places', []))} places)")
+
+
+def stats() -> dict:
+    """Store size and hit rate since start-up, for the admin page."""
+    s = RESULT_STORE.stats()
+    lookups = s["hits"] + s["misses"]
+    s["hit_rate"] = round(s["hits"] / lookups, 3) if lookups else None
+    return s
+
+
+# ---------------------------------------------------------------------------
+# Near-duplicate routes
+# ---------------------------------------------------------------------------
+
+def _sample_route(route: LineString) -> Tuple[np.ndarray, np.ndarray]:
+    """(lons, lats) of points every FINGERPRINT_SAMPLE_KM along the route, ends included."""
+    proj = LocalProjection.for_geometry(route)
+    metric = proj.forward(route)
+    n = max(2, int(math.ceil(metric.length / FINGERPRINT_SAMPLE_KM)) + 1)
+    points = shapely.line_interpolate_point(metric, np.linspace(0.0, metric.length, n))
+    coords = shapely.get_coordinates(points)
+    return proj.to_lonlat(coords[:, 0], coords[:, 1])
+
+
+def _fingerprint(lons: np.ndarray, lats: np.ndarray) -> Set[str]:
+    cells = zip(np.floor(lats / FINGERPRINT_CELL_DEG).astype(int), np.floor(lons / FINGERPRINT_CELL_DEG).astype(int))
+    return {f"cell:{y}:{x}" for y, x in cells}
+
+
+def save_route_pois(
+    key: str,
+    route_points: List[Tuple[float, float]],
+    place_types: Dict[str, float],
+    places_per_type: Dict[str, Dict[tuple, dict]],
+    fetched_at: float,
+) -> None:
+    """
+    Index a finished search's route and raw per-type POIs for find_similar_routes.
+
+    fetched_at: when the oldest POI data of the search was fetched — the record
+    expires RESULT_STORE_TTL_S after it, not after this call.
+    """
+    route = LineString(route_points)
+    ROUTE_INDEX.put(f"pois:{key}", {
+        "route": [[round(lon, ROUTE_DECIMALS), round(lat, ROUTE_DECIMALS)] for lon, lat in route.coords],
+        "types": place_types,
+        "data": data_version(),
+        "fetched_at": fetched_at,
+        "places": {
+            pt: [{k: v for k, v in place.items() if k != "config"} for place in places.values()]
+            for pt, places in places_per_type.items()
+        },
+    }, created_at=fetched_at)
+    if time.time() - fetched_at > RESULT_STORE_TTL_S:
+        return  # too old to be indexed at all
+    for cell in _fingerprint(*_sample_route(route)):
+        posting = ROUTE_INDEX.get(cell) or {}
+        posting[key] = fetched_at
+        if len(posting) > MAX_ROUTES_PER_CELL:
+            posting = dict(sorted(posting.items(), key=lambda kv: kv[1])[-MAX_ROUTES_PER_CELL:])
+        ROUTE_INDEX.put(cell, posting)
+
+
+class RouteMatch:
+    """An earlier search whose corridor covers part of a new route."""
+
+    def __init__(
+        self,
+        key: str,
+        route: LineString,
+        radii: Dict[str, float],
+        places: Dict[str, List[dict]],
+        covered_share: float,
+        fetched_at: float,
+    ):
+        self.key = key
+        self.route = route
+        self.radii = radii            # {place_type: km} the earlier search fetched
+        self.places = places
+        self.covered_share = covered_share
+        self.fetched_at = fetched_at  # when its oldest POI data was fetched
+
+
+def find_similar_routes(route: LineString, place_types: Dict[str, float]) -> List[RouteMatch]:
+    """
+    Return earlier searches (same POI data, at least one requested type
+    fetched) whose route runs within OVERLAP_PAD_KM of `route`,
+    best coverage first.  Each match must add at least MIN_COVERED_SHARE of
+    the route to what the better ones already cover.
+
+    Each match's places are those within their type's padded radius of `route`,
+    with distance_km measured to `route`.  A type fetched at a smaller radius
+    than requested is known only out to match.radii[type] — the caller queries
+    the ring beyond it.
+    """
+    lons, lats = _sample_route(route)
+    cells = _fingerprint(lons, lats)
+    shared: Counter = Counter()
+    for cell in cells:
+        shared.update((ROUTE_INDEX.get(cell) or {}).keys())
+
+    version = data_version()
+    proj = LocalProjection.for_geometry(route)
+    candidates: List[Tuple[str, dict, LineString, np.ndarray]] = []
+    for key, n_cells in shared.most_common(MAX_MATCH_CANDIDATES):
+        if n_cells < MIN_SHARED_CELLS * len(cells):
+            break
+        record = ROUTE_INDEX.get(f"pois:{key}")
+        if not record or record["data"] != version:
+            continue
+        if not any(pt in record["types"] for pt in place_types):
+            continue
+        earlier = LineString(record["route"])
+        # Directed Hausdorff, sampled: which parts of the new route lie along the earlier one
+        near = proj.distances_km(earlier, lons, lats) <= OVERLAP_PAD_KM
+        candidates.append((key, record, earlier, near))
+
+    # Most route covered first; among equals, the one that knows the most of the requested radii
+    candidates.sort(key=lambda c: (
+        -int(c[3].sum()),
+        -sum(min(c[1]["types"].get(pt, 0.0), km) / km for pt, km in place_types.items() if km > 0),
+    ))
+    covered = np.zeros(len(lons), dtype=bool)
+    matches: List[RouteMatch] = []
+    for key, record, earlier, near in candidates:
+        if (near & ~covered).mean() < MIN_COVERED_SHARE:
+            continue
+        covered |= near
+
+        places: Dict[str, List[dict]] = {}
+        for pt, radius_km in place_types.items():
+            found = record["places"].get(pt, [])
+            if not found:
+                continue
+            dists = proj.distances_km(
+                route,
+                np.fromiter((p["lon"] for p in found), dtype=float, count=len(found)),
+                np.fromiter((p["lat"] for p in found), dtype=float, count=len(found)),
+            )
+            places[pt] = [
+                {**p, "distance_km": round(float(d), 3), "config": PLACE_TYPE_CONFIG[pt]}
+                for p, d in zip(found, dists) if d <= radius_km + OVERLAP_PAD_KM
+            ]
+        radii = {pt: record["types"][pt] for pt in place_types if pt in record["types"]}
+        matches.append(RouteMatch(key, earlier, radii, places, float(near.mean()), record["fetched_at"]))
+        if covered.all():
+            break
+    return matches
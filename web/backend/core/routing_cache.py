@@ -0,0 +1,39 @@
+"""
+Persistent routing cache shared by the OSRM and Valhalla helpers.
+
+The same detours — route to fuel station and back — recur across searches,
+re-exports and refines.  Answers are stored on disk keyed by service, profile
+and the request's points snapped to a ~10 m grid, so a start point a few
+metres off still hits.  Entries expire after ROUTING_CACHE_TTL_S (roads change
+slowly) and the least recently used go first once ROUTING_CACHE_MAX_BYTES is
+reached.  Failed lookups are never cached.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from typing import Iterable, Tuple
+
+from .cache import CACHE_DIR, SqliteCache
+
+ROUTING_CACHE_TTL_S = 30 * 24 * 3600
+ROUTING_CACHE_MAX_BYTES = 100 * 1024 * 1024
+ROUTING_GRID_DEG = 0.0001   # ~11 m of latitude; endpoints closer than this share a route
+ROUTING_CACHE = SqliteCache(CACHE_DIR / "routing.sqlite", ROUTING_CACHE_TTL_S, ROUTING_CACHE_MAX_BYTES)
+
+
+def _snap(value: float) -> int:
+    return round(value / ROUTING_GRID_DEG)
+
+
+def routing_key(service: str, profile: str, points: Iterable[Tuple[float, float]], extra: str = "") -> str:
+    """
+    Cache key for a routing request.
+
+    points: (lat, lon) in request order — direction matters for routing.
+    extra: anything else that changes the answer (costing options, annotations).
+    """
+    snapped = [(_snap(lat), _snap(lon)) for lat, lon in points]
+    payload = json.dumps([service, profile, snapped, extra], separators=(",", ":"))
+    return f"{service}:{profile}:" + hashlib.sha256(payload.encode("utf-8")).hexdigest()
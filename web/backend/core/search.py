@@ -7,62 +7,26 @@ from __future__ import annotations
 
 import logging
 import time
+import uuid
 from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from typing import Callable, Dict, Generator, List, Optional, Tuple
 
 from geopy.distance import geodesic
 from shapely.geometry import LineString, Point
+from shapely.geometry.base import BaseGeometry
 
 from .gpx_parser import RoutePoint, calculate_total_distance_km
-from .osrm import get_road_route
-from .overpass import collect_all_types_from_segment
+from .osrm import MAX_TABLE_COORDS, get_detour_table, get_road_route
+from .overpass import POI_BACKEND, QueryTimedOut, QueryTooLarge, collect_all_types_from_segment, is_segment_cached
 from .place_types import PLACE_TYPE_CONFIG
+from .result_store import find_similar_routes, load_result, result_key, save_result, save_route_pois
+from .segmenter import OVERLAP_PAD_KM, AdaptiveSegmenter, RouteCoverage
 
 logger = logging.getLogger(__name__)
 
-CHUNK_KM = 50
-OVERPASS_PAUSE = 5.0   # seconds between sequential Overpass requests (polite usage)
 MAX_OSRM_WORKERS = 2   # public router.project-osrm.org rate-limits parallel requests
 
 
-# ---------------------------------------------------------------------------
-# Route segmentation
-# ---------------------------------------------------------------------------
-
-def split_line_by_distance(line: LineString, max_km: float) -> List[LineString]:
-    """Split a LineString into segments of at most max_km each."""
-    segments: List[LineString] = []
-    coords = list(line.coords)
-    current_chunk = [coords[0]]
-    dist_accum = 0.0
-
-    for i in range(1, len(coords)):
-        pt1 = (coords[i - 1][1], coords[i - 1][0])
-        pt2 = (coords[i][1], coords[i][0])
-        seg_dist = geodesic(pt1, pt2).km
-
-        if dist_accum + seg_dist > max_km and len(current_chunk) > 1:
-            segments.append(LineString(current_chunk))
-            current_chunk = [coords[i - 1], coords[i]]
-            dist_accum = seg_dist
-        else:
-            current_chunk.append(coords[i])
-            dist_accum += seg_dist
-
-    if len(current_chunk) > 1:
-        segments.append(LineString(current_chunk))
-    elif segments and len(current_chunk) == 1:
-        # Merge single trailing point into last segment
-        last_coords = list(segments[-1].coords) + current_chunk
-        segments[-1] = LineString(last_coords)
-
-    # Fallback: if no segments produced (very short route), return whole line
-    if not segments:
-        segments = [line]
-
-    return segments
-
-
 # ---------------------------------------------------------------------------
 # Deduplication (ported from original)
 # ---------------------------------------------------------------------------
@@ -129,6 +93,108 @@ class SearchConfig:
         self.place_types = place_types
 
 
+# ---------------------------------------------------------------------------
+# Per-type query planning
+# ---------------------------------------------------------------------------
+#
+# Route parts can be known for some types only, or out to a smaller radius
+# only (an earlier search of a similar route — see find_similar_routes).  Each
+# segment is therefore split per type into the part still to query in full and
+# the part that only needs the ring beyond the known radius; types with the
+# same part and ring share one Overpass request.
+
+QueryGroup = Tuple[BaseGeometry, float, List[dict]]  # (route part, its km, type jobs)
+
+
+def _query_groups(
+    seg: LineString,
+    type_jobs: List[dict],
+    coverage: Dict[str, RouteCoverage],
+    rings: Dict[str, Tuple[RouteCoverage, float]],
+) -> List[QueryGroup]:
+    """Return the queries needed for one segment; empty when everything is known."""
+    groups: Dict[tuple, QueryGroup] = {}
+
+    def _add(geom: BaseGeometry, km: float, job: dict) -> None:
+        key = (geom.wkb, job.get("inner_km"))
+        if key not in groups:
+            groups[key] = (geom, km, [])
+        groups[key][2].append(job)
+
+    for job in type_jobs:
+        todo, todo_km = coverage[job["place_type"]].uncovered(seg)
+        if todo.is_empty:
+            continue
+        ring = rings.get(job["place_type"])
+        if ring is None:
+            _add(todo, todo_km, job)
+            continue
+        ring_coverage, inner_km = ring
+        full, full_km = ring_coverage.uncovered(todo)
+        if not full.is_empty:
+            _add(full, full_km, job)
+        known, known_km = ring_coverage.covered(todo)
+        if not known.is_empty:
+            _add(known, known_km, {**job, "inner_km": inner_km})
+    return list(groups.values())
+
+
+def _collect_groups(
+    groups: List[QueryGroup],
+    cancel_check: Optional[Callable[[], bool]],
+    job_id: str,
+    on_queue: Callable[[int], None],
+    on_request: Callable[[float], None],
+    on_fetched: Callable[[float], None],
+) -> Dict[str, Dict[tuple, dict]]:
+    """Run collect_all_types_from_segment for each group and merge the places per type."""
+    merged: Dict[str, Dict[tuple, dict]] = {}
+    for geom, _, jobs in groups:
+        results = collect_all_types_from_segment(geom, jobs, cancel_check, job_id, on_queue, on_request, on_fetched)
+        for pt, places in results.items():
+            merged.setdefault(pt, {}).update(places)
+    return merged
+
+
+# ---------------------------------------------------------------------------
+# Detour geometry (on demand)
+# ---------------------------------------------------------------------------
+
+def fetch_road_routes(route_points: List[RoutePoint], places: List[dict]) -> Dict[str, List]:
+    """
+    Road geometry from the nearest route point to each place, via OSRM with
+    MAX_OSRM_WORKERS parallel requests.  Returns {place_id: [[lon, lat], ...]};
+    places on the track get none, and a straight line stands in where OSRM
+    has no answer.
+    """
+    route_line = LineString(route_points)
+    routing_jobs = []  # (place_id, start_lat, start_lon, end_lat, end_lon)
+    for place in places:
+        if place["distance_km"] < 0.2:
+            continue  # On track — no detour needed
+        nearest = route_line.interpolate(route_line.project(Point(place["lon"], place["lat"])))
+        routing_jobs.append((place["id"], float(nearest.y), float(nearest.x), place["lat"], place["lon"]))
+
+    def _fetch_route(job):
+        pid, s_lat, s_lon, e_lat, e_lon = job
+        route = get_road_route(s_lat, s_lon, e_lat, e_lon)
+        if route and len(route) > 1:
+            return pid, [list(coord) for coord in route]
+        # OSRM unavailable — straight-line fallback so map always shows a line
+        return pid, [[s_lon, s_lat], [e_lon, e_lat]]
+
+    road_routes: Dict[str, List] = {}
+    with ThreadPoolExecutor(max_workers=MAX_OSRM_WORKERS) as executor:
+        for future in as_completed([executor.submit(_fetch_route, job) for job in routing_jobs]):
+            try:
+                pid, route = future.result()
+                road_routes[pid] = route
+            except Exception as e:
+                logger.warning(f"Road route fetch error: {e}")
+    logger.info(f"Road routes fetched for {len(road_routes)} of {len(places)} places")
+    return road_routes
+
+
 # ---------------------------------------------------------------------------
 # Main search function (yields progress events)
 # ---------------------------------------------------------------------------
@@ -137,99 +203,251 @@ def run_search(
     route_points: List[RoutePoint],
     config: SearchConfig,
     cancel_check: Optional[Callable[[], bool]] = None,
+    job_id: Optional[str] = None,
+    prior_config: Optional[SearchConfig] = None,
+    prior_result: Optional[dict] = None,
 ) -> Generator[dict, None, None]:
     """
     Generator that yields progress/result dicts.
 
+    job_id identifies this search in the shared Overpass scheduler (fair
+    round-robin between concurrent searches); a random id is used if omitted.
+
+    prior_config / prior_result: an earlier search of the same route points
+    (refine).  Its places are carried over — with their distances and detour
+    costs — and only new types and the ring of widened radii are queried.
+
+    Road geometry of the detours is not part of the result; it is fetched on
+    demand for the places highlighted, ticked or exported (fetch_road_routes).
+
     Event types:
       {"type": "progress", "message": str, "percent": float}
-      {"type": "result",   "places": [...], "road_routes": {...}, "route_points": [...], "total_km": float}
+      {"type": "result",   "places": [...], "route_points": [...], "total_km": float,
+                           "gaps_km": [[start_km, end_km], ...],   # segments that failed
+                           "fetched_at": float}   # when the oldest POI data used was fetched
       {"type": "error",    "message": str}
       {"type": "cancelled"}
     """
     def _cancelled() -> bool:
         return cancel_check() if cancel_check else False
 
+    job_id = job_id or uuid.uuid4().hex
+
     try:
         total_km = calculate_total_distance_km(route_points)
         yield {"type": "progress", "message": f"Route loaded: {total_km:.1f} km, {len(route_points)} points", "percent": 2}
 
-        route_line = LineString(route_points)
-        segments = split_line_by_distance(route_line, CHUNK_KM)
-        yield {"type": "progress", "message": f"Split into {len(segments)} search segments", "percent": 5}
+        # Same route, types, radii and POI data as an earlier search: reuse its result
+        store_key = result_key(route_points, config.place_types)
+        stored = load_result(store_key)
+        if stored is not None:
+            yield {"type": "progress", "message": "Served from result store", "percent": 100, "result_store": "hit"}
+            yield {"type": "result", **stored}
+            return
 
+        route_line = LineString(route_points)
         all_places_raw: Dict[tuple, dict] = {}
         place_types = list(config.place_types.items())
         n_types = len(place_types)
 
-        # Build the type-job descriptor list (shared across all segments)
+        # Build the type-job descriptor list (shared across all segments).  Radii
+        # are padded by OVERLAP_PAD_KM so a stretch of route that runs along an
+        # already queried part can be skipped (see RouteCoverage); the exact
+        # radius is applied again in the distance calculation below.
         type_job_list = [
             {
                 "place_type": place_type,
                 "pt_config": PLACE_TYPE_CONFIG[place_type],
-                "buffer_deg": distance_km / 111.0,
-                "buffer_km": distance_km,
+                "buffer_deg": (distance_km + OVERLAP_PAD_KM) / 111.0,
+                "buffer_km": distance_km + OVERLAP_PAD_KM,
                 "on_route_only": PLACE_TYPE_CONFIG[place_type].get("on_route_only", False),
             }
             for place_type, distance_km in place_types
         ]
         places_per_type: Dict[str, Dict[tuple, dict]] = {pt: {} for pt, _ in place_types}
 
-        total_segs = len(segments)
+        # Segment lengths adapt to the POI density along the route (see core/segmenter.py)
+        segmenter = AdaptiveSegmenter(route_line, type_job_list)
+        # Per type: route parts whose POIs are known at the requested radius, and
+        # parts known out to a smaller radius only (queried as a ring)
+        coverage = {pt: RouteCoverage() for pt, _ in place_types}
+        rings: Dict[str, Tuple[RouteCoverage, float]] = {}
+        route_km = max(segmenter.total_km, 0.001)
+
+        # Refining an earlier search of this route: its types are known out to their old radius
+        prior_places: Dict[tuple, dict] = {}
+        # When each POI answer used was fetched; the result is as old as the oldest
+        fetch_times: List[float] = []
+        if prior_config is not None and prior_result is not None:
+            fetch_times.append(prior_result["fetched_at"])
+            # Only what the earlier search actually queried is known: its failed
+            # segments are queried again, as if it had never run there
+            known_parts = segmenter.parts_outside(prior_result.get("gaps_km", []))
+            for pt, known_km in prior_config.place_types.items():
+                if pt not in config.place_types:
+                    continue
+                if known_km >= config.place_types[pt]:
+                    for part in known_parts:
+                        coverage[pt].add(part)
+                else:
+                    ring_coverage = RouteCoverage()
+                    for part in known_parts:
+                        ring_coverage.add(part)
+                    rings[pt] = (ring_coverage, known_km)
+            for place in prior_result["places"]:
+                pt = place["place_type"]
+                if pt not in config.place_types or place["distance_km"] > config.place_types[pt]:
+                    continue
+                key = (place["lat"], place["lon"], pt)
+                prior_places[key] = place
+                places_per_type[pt][key] = {**place, "config": PLACE_TYPE_CONFIG[pt]}
+            yield {
+                "type": "progress",
+                "message": f"Refining the previous search — {len(prior_places)} places carried over",
+                "percent": 4,
+            }
+
+        # Another recording of a route searched before: reuse its POIs and only
+        # query the stretches it does not cover
+        for match in find_similar_routes(route_line, config.place_types):
+            fetch_times.append(match.fetched_at)
+            for pt, known_km in match.radii.items():
+                if known_km >= config.place_types[pt]:
+                    coverage[pt].add(match.route)
+                else:
+                    ring_coverage, inner_km = rings.get(pt, (RouteCoverage(), known_km))
+                    ring_coverage.add(match.route)
+                    rings[pt] = (ring_coverage, min(inner_km, known_km))
+            for pt, places in match.places.items():
+                places_per_type[pt].update(((p["lat"], p["lon"], pt), p) for p in places)
+            n_reused = sum(len(v) for v in match.places.values())
+            yield {
+                "type": "progress",
+                "message": (
+                    f"Similar route searched before — reusing {n_reused} places "
+                    f"({match.covered_share * 100:.0f}% of the route covered)"
+                ),
+                "percent": 4,
+            }
         yield {
             "type": "progress",
-            "message": (
-                f"Querying Overpass: {total_segs} segment(s), "
-                f"all {n_types} type(s) per request (around filter)…"
+            "message": {
+                "offline": f"Searching the offline POI index in adaptive segments, all {n_types} type(s) at once…",
+                "tiles": f"Loading POI tiles in adaptive segments, all {n_types} type(s) per request…",
+            }.get(
+                POI_BACKEND,
+                f"Querying Overpass in adaptive segments, all {n_types} type(s) per request "
+                f"(around / poly / bbox filter, whichever is cheapest per segment)…",
             ),
             "percent": 5,
         }
 
-        # Sequential requests — the public Overpass server does not like parallel
-        # queries from the same IP.  A {OVERPASS_PAUSE}s pause between requests is polite.
-        for seg_idx, seg in enumerate(segments):
-            if _cancelled():
-                yield {"type": "cancelled"}
-                return
+        # All Overpass traffic goes through the process-wide scheduler, which
+        # spaces requests per mirror and serves concurrent jobs round-robin.
+        # The query runs in a helper thread so queue positions can be reported.
+        seg_idx = 0
+        gaps: List[Tuple[float, float]] = []  # failed segments (km); a result with gaps is not stored
+        with ThreadPoolExecutor(max_workers=1) as seg_executor:
+            while (piece := segmenter.next_segment()) is not None:
+                if _cancelled():
+                    yield {"type": "cancelled"}
+                    return
 
-            if seg_idx > 0:
+                seg_idx += 1
+                start_km, end_km, seg = piece
+                span = f"km {start_km:.0f}–{end_km:.0f} of {route_km:.0f}"
+                percent = 5 + (start_km / route_km) * 60
+
+                # Out-and-back and looping routes: only query what earlier segments missed
+                groups = _query_groups(seg, type_job_list, coverage, rings)
+                if not groups:
+                    yield {
+                        "type": "progress",
+                        "message": f"  Segment {seg_idx} ({span}) already covered by earlier queries",
+                        "percent": 5 + (segmenter.done_km / route_km) * 60,
+                    }
+                    continue
+                todo_km = max(km for _, km, _ in groups)
+                if len(groups) > 1 or todo_km < (end_km - start_km) * 0.95:
+                    logger.info(
+                        f"Segment {seg_idx} ({span}): " + "; ".join(
+                            f"{km:.1f} km for " + "+".join(
+                                j["place_type"] + (" (ring)" if "inner_km" in j else "") for j in jobs
+                            )
+                            for _, km, jobs in groups
+                        )
+                    )
+                cached = all(is_segment_cached(geom, jobs) for geom, _, jobs in groups)
                 yield {
                     "type": "progress",
-                    "message": f"  Waiting {OVERPASS_PAUSE:.0f}s before next segment…",
-                    "percent": 5 + (seg_idx / total_segs) * 60,
+                    "message": (
+                        f"  Segment {seg_idx} ({span}) served from cache"
+                        if cached else
+                        f"  Querying Overpass for segment {seg_idx} ({span})… (may take up to 45s)"
+                    ),
+                    "percent": percent,
                 }
-                time.sleep(OVERPASS_PAUSE)
 
-            yield {
-                "type": "progress",
-                "message": f"  Querying Overpass for segment {seg_idx+1}/{total_segs}… (may take up to 45s)",
-                "percent": 5 + (seg_idx / total_segs) * 60,
-            }
-
-            try:
-                seg_results = collect_all_types_from_segment(seg, type_job_list, cancel_check)
-                for pt, places in seg_results.items():
-                    places_per_type[pt].update(places)
-                counts = {pt: len(v) for pt, v in places_per_type.items() if v}
-                logger.info(f"Segment {seg_idx+1}/{total_segs} done — totals: {counts}")
-            except Exception as e:
-                logger.error(f"Segment {seg_idx+1} error: {e}")
-
-            counts_str = ", ".join(
-                f"{PLACE_TYPE_CONFIG[pt]['emoji']} {len(v)}"
-                for pt, v in places_per_type.items() if v
-            )
-            yield {
-                "type": "progress",
-                "message": (
-                    f"  [{seg_idx+1}/{total_segs}] segment done"
-                    + (f" — {counts_str}" if counts_str else "")
-                ),
-                "percent": 5 + ((seg_idx + 1) / total_segs) * 60,
-            }
+                positions: List[int] = []
+                request_times: List[float] = []
+                future = seg_executor.submit(
+                    _collect_groups, groups, cancel_check, job_id, positions.append, request_times.append,
+                    fetch_times.append,
+                )
+                last_position = 0
+                while not wait([future], timeout=1.0).done:
+                    position = positions[-1] if positions else 0
+                    if position and position != last_position:
+                        yield {
+                            "type": "progress",
+                            "message": f"  Waiting for an Overpass slot — position {position} in queue",
+                            "percent": percent,
+                        }
+                    last_position = position
+
+                try:
+                    seg_results = future.result()
+                    for pt, places in seg_results.items():
+                        places_per_type[pt].update(places)
+                    segmenter.report_ok(
+                        piece, {pt: len(v) for pt, v in seg_results.items()}, sum(request_times), todo_km,
+                    )
+                    for geom, _, jobs in groups:
+                        for job in jobs:
+                            coverage[job["place_type"]].add(geom)
+                    counts = {pt: len(v) for pt, v in places_per_type.items() if v}
+                    logger.info(f"Segment {seg_idx} ({span}) done — totals: {counts}")
+                except QueryTooLarge as e:
+                    # A client timeout may be the network: split, but learn no density ceiling from it
+                    if segmenter.report_too_large(piece, learn=not isinstance(e, QueryTimedOut)):
+                        yield {
+                            "type": "progress",
+                            "message": f"  Segment {seg_idx} too dense for one query — splitting it in half",
+                            "percent": percent,
+                        }
+                        continue
+                    logger.error(f"Segment {seg_idx} error: {e}")
+                    gaps.append((start_km, end_km))
+                except Exception as e:
+                    logger.error(f"Segment {seg_idx} error: {e}")
+                    gaps.append((start_km, end_km))
+
+                counts_str = ", ".join(
+                    f"{PLACE_TYPE_CONFIG[pt]['emoji']} {len(v)}"
+                    for pt, v in places_per_type.items() if v
+                )
+                yield {
+                    "type": "progress",
+                    "message": (
+                        f"  [{span}] segment done"
+                        + (f" — {counts_str}" if counts_str else "")
+                    ),
+                    "percent": 5 + (segmenter.done_km / route_km) * 60,
+                }
 
         for place_type, places_for_type in places_per_type.items():
             all_places_raw.update(places_for_type)
+            fetch_times.extend(p["fetched_at"] for p in places_for_type.values())
             pt_config = PLACE_TYPE_CONFIG[place_type]
             yield {
                 "type": "progress",
@@ -256,13 +474,20 @@ def run_search(
                 yield {"type": "cancelled"}
                 return
 
-            place_point = Point(place["lon"], place["lat"])
-            route_position = route_line.project(place_point)
-            nearest = route_line.interpolate(route_position)
-            dist_km = geodesic(
-                (place["lat"], place["lon"]),
-                (nearest.y, nearest.x),
-            ).km
+            known = prior_places.get((place["lat"], place["lon"], place["place_type"]))
+            if known is not None:
+                route_position, dist_km = known["route_position"], known["distance_km"]
+            else:
+                place_point = Point(place["lon"], place["lat"])
+                route_position = route_line.project(place_point)
+                nearest = route_line.interpolate(route_position)
+                dist_km = geodesic(
+                    (place["lat"], place["lon"]),
+                    (nearest.y, nearest.x),
+                ).km
+            radius_km = config.place_types[place["place_type"]]
+            if place["distance_km"] > radius_km and dist_km > radius_km:
+                continue  # only inside the padded query radius
 
             pt_config = PLACE_TYPE_CONFIG[place["place_type"]]
             enhanced_places.append({
@@ -278,77 +503,67 @@ def run_search(
                 "emoji": pt_config["emoji"],
                 "type_label": pt_config["name"],
                 "included": True,
+                "fetched_at": place["fetched_at"],
             })
 
             if (i + 1) % 10 == 0 or (i + 1) == len(deduped):
                 yield {
                     "type": "progress",
                     "message": f"Calculated distances: {i+1}/{len(deduped)}",
-                    "percent": 70 + (i + 1) / len(deduped) * 15,
+                    "percent": 70 + (i + 1) / len(deduped) * 10,
                 }
 
         # Sort each type by route position
         enhanced_places.sort(key=lambda p: p["route_position"])
 
-        # ---- Road routing (parallel) ----
-        # Pre-compute nearest route point for each place that needs routing
-        routing_jobs = []  # (place_id, start_lat, start_lon, end_lat, end_lon)
+        # ---- Detour cost (OSRM table) ----
+        # Round-trip road distance and time from the nearest route point, for
+        # up to MAX_TABLE_COORDS / 2 consecutive places per table request.
+        detour_jobs = []  # (place, access_lat, access_lon)
         for place in enhanced_places:
-            if place["distance_km"] < 0.2:
-                continue  # On track — no detour needed
-            place_point = Point(place["lon"], place["lat"])
-            nearest = route_line.interpolate(route_line.project(place_point))
-            routing_jobs.append((
-                place["id"],
-                float(nearest.y), float(nearest.x),
-                place["lat"], place["lon"],
-            ))
-
-        n_jobs = len(routing_jobs)
+            known = prior_places.get((place["lat"], place["lon"], place["place_type"]))
+            if known is not None and known.get("detour_km") is not None:
+                place["detour_km"], place["detour_min"] = known["detour_km"], known["detour_min"]
+            elif place["distance_km"] < 0.2:
+                place["detour_km"], place["detour_min"] = 0.0, 0.0  # on track
+            else:
+                place["detour_km"] = place["detour_min"] = None
+                nearest = route_line.interpolate(place["route_position"])
+                detour_jobs.append((place, float(nearest.y), float(nearest.x)))
+
+        detours_complete = True  # False if a table request failed — POIs are still stored
+        per_table = MAX_TABLE_COORDS // 2
+        tables = [detour_jobs[i:i + per_table] for i in range(0, len(detour_jobs), per_table)]
         yield {
             "type": "progress",
-            "message": f"Calculating road routes for {n_jobs} places ({MAX_OSRM_WORKERS} parallel)...",
-            "percent": 85,
+            "message": f"Calculating detour costs for {len(detour_jobs)} places ({len(tables)} table request(s))...",
+            "percent": 80,
         }
-
-        road_routes: Dict[str, List] = {}
-
-        def _fetch_route(job):
-            pid, s_lat, s_lon, e_lat, e_lon = job
-            route = get_road_route(s_lat, s_lon, e_lat, e_lon)
-            return pid, route, s_lat, s_lon, e_lat, e_lon
-
         with ThreadPoolExecutor(max_workers=MAX_OSRM_WORKERS) as executor:
-            future_to_job = {executor.submit(_fetch_route, job): job for job in routing_jobs}
-            pending = set(future_to_job.keys())
-            completed = 0
-
+            future_to_table = {
+                executor.submit(get_detour_table, [(a_lat, a_lon, p["lat"], p["lon"]) for p, a_lat, a_lon in table]): table
+                for table in tables
+            }
+            pending = set(future_to_table)
             while pending:
                 if _cancelled():
                     yield {"type": "cancelled"}
                     return
-
                 done, pending = wait(pending, timeout=3.0, return_when=FIRST_COMPLETED)
-
                 for future in done:
-                    completed += 1
-                    try:
-                        pid, route, s_lat, s_lon, e_lat, e_lon = future.result()
-                        if route and len(route) > 1:
-                            road_routes[pid] = route
-                        else:
-                            # OSRM unavailable — straight-line fallback so map always shows a line
-                            road_routes[pid] = [[s_lon, s_lat], [e_lon, e_lat]]
-                    except Exception as e:
-                        logger.warning(f"Road route fetch error: {e}")
-
-                still_running = len(pending)
-                suffix = f" ({still_running} in progress…)" if still_running else ""
-                yield {
-                    "type": "progress",
-                    "message": f"Road routes: {completed}/{n_jobs} done ({len(road_routes)} found){suffix}",
-                    "percent": 85 + completed / max(n_jobs, 1) * 13,
-                }
+                    costs = future.result()
+                    if costs is None:
+                        detours_complete = False  # keep these detours unknown
+                        continue
+                    for (place, _, _), cost in zip(future_to_table[future], costs):
+                        if cost is not None:
+                            place["detour_km"], place["detour_min"] = round(cost[0], 2), round(cost[1], 1)
+                if done:
+                    yield {
+                        "type": "progress",
+                        "message": f"Detour costs: {len(tables) - len(pending)}/{len(tables)} table requests done",
+                        "percent": 80 + (len(tables) - len(pending)) / max(len(tables), 1) * 5,
+                    }
 
         yield {"type": "progress", "message": "Search complete!", "percent": 99}
 
@@ -363,13 +578,20 @@ def run_search(
             "percent": 100,
         }
 
-        yield {
-            "type": "result",
+        result = {
             "places": enhanced_places,
-            "road_routes": road_routes,
             "route_points": route_points,
             "total_km": total_km,
+            "gaps_km": gaps,
+            "fetched_at": min(fetch_times, default=time.time()),
         }
+        # Missing detours only affect ranking: the POIs are indexed for reuse
+        # either way, the ranked result only once every detour is known.
+        if not gaps:
+            if detours_complete:
+                save_result(store_key, result)
+            save_route_pois(store_key, route_points, config.place_types, places_per_type, result["fetched_at"])
+        yield {"type": "result", **result}
 
     except Exception as e:
         logger.exception("Search failed")
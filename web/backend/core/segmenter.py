@@ -0,0 +1,303 @@
+"""
+Adaptive route segmentation for Overpass queries.
+
+A fixed segment length is wrong in both directions: in a dense city a long
+segment produces a huge answer that times out, in empty countryside a short
+one wastes a request slot on a near-empty stretch.  AdaptiveSegmenter picks
+each segment's length from the POI density expected along it, grows while
+answers stay small and fast, and splits a segment in half when its query
+timed out or hit maxsize.
+
+Observed densities — and the length at which a query last proved too heavy —
+are remembered per ~0.5° region (DENSITY_STORE), so later searches through
+the same area start with a good size.
+
+Learned sizes change between runs, but the Overpass response cache is keyed
+on segment geometry.  Boundaries are therefore snapped to SEGMENT_GRID_KM,
+and the boundaries a route was cut at are remembered (PLAN_STORE): running
+the same route and radii again replays them, so its queries are identical
+and answered from the cache.
+
+RouteCoverage keeps the route parts already queried, so out-and-back rides
+and figure-eight loops only query the stretches they have not covered yet.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import math
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+import shapely
+from shapely.geometry import LineString, MultiLineString, box
+from shapely.geometry.base import BaseGeometry
+from shapely.ops import unary_union
+
+from .cache import CACHE_DIR, SqliteCache
+from .geo import EARTH_RADIUS_KM, LocalProjection
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEGMENT_KM = 50.0     # starting size where nothing is known yet
+MIN_SEGMENT_KM = 5.0
+MAX_SEGMENT_KM = 150.0
+TARGET_ELEMENTS = 1500        # aim for answers around this many matching POIs
+SLOW_REQUEST_S = 20.0         # above this, stop growing and shrink instead
+MAX_GROWTH = 2.0              # a segment is at most twice as long as the previous one
+CEILING_GROWTH = 1.25         # a region's length ceiling rises this much after a fast answer at it
+DENSITY_CELL_DEG = 0.5
+DENSITY_SAMPLE_KM = 10.0      # a segment's density is recorded at points this far apart
+DENSITY_SMOOTHING = 0.5       # weight of a new observation in the stored average
+DENSITY_STORE = SqliteCache(CACHE_DIR / "density.sqlite", 90 * 24 * 3600, 16 * 1024 * 1024)
+SEGMENT_GRID_KM = 5.0         # boundaries fall on multiples of this (route end excepted)
+# Boundaries per route + radii; as long as the Overpass response cache keeps answers
+PLAN_STORE = SqliteCache(CACHE_DIR / "segment_plans.sqlite", 7 * 24 * 3600, 16 * 1024 * 1024)
+# Route within this distance of an already queried part counts as covered; every
+# query radius is padded by it so the earlier answer holds the full corridor.
+OVERLAP_PAD_KM = 0.05
+MIN_UNCOVERED_KM = 0.01       # leftovers shorter than this are noise, not route
+
+
+def _cell_key(lon: float, lat: float) -> str:
+    return f"{math.floor(lat / DENSITY_CELL_DEG)}:{math.floor(lon / DENSITY_CELL_DEG)}"
+
+
+def _plan_key(coords: np.ndarray, radii: Dict[str, float]) -> str:
+    payload = json.dumps(
+        {"route": np.round(coords, 6).tolist(), "radii": sorted(radii.items())}, separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _cumulative_km(coords: np.ndarray) -> np.ndarray:
+    """Haversine distance from the first vertex to each vertex, in km."""
+    lon = np.radians(coords[:, 0])
+    lat = np.radians(coords[:, 1])
+    a = (np.sin(np.diff(lat) / 2) ** 2
+         + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2)
+    steps = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+    return np.concatenate([[0.0], np.cumsum(steps)])
+
+
+class AdaptiveSegmenter:
+    """
+    Hands out route segments one at a time; report each outcome back.
+
+        segmenter = AdaptiveSegmenter(route_line, type_jobs)
+        while (piece := segmenter.next_segment()) is not None:
+            ...
+            segmenter.report_ok(piece, counts, request_s)   # or report_too_large(piece)
+    """
+
+    def __init__(self, route: LineString, type_jobs: List[dict]):
+        self._coords = np.asarray(route.coords)[:, :2]
+        self._cum_km = _cumulative_km(self._coords)
+        self.total_km = float(self._cum_km[-1])
+        self._radii = {j["place_type"]: j["buffer_km"] for j in type_jobs}
+        self._pos_km = 0.0
+        self._last_km = 0.0
+        self._last_slow = False
+        self._splits: Deque[Tuple[float, float]] = deque()  # halves of too-large segments
+        self._plan_key = _plan_key(self._coords, self._radii)
+        self._plan: List[float] = PLAN_STORE.get(self._plan_key) or []  # boundaries of earlier runs
+
+    @property
+    def done_km(self) -> float:
+        """Route distance covered so far (for progress reporting)."""
+        return self._splits[0][0] if self._splits else self._pos_km
+
+    # ---- geometry ---------------------------------------------------------
+
+    def _point_at(self, km: float) -> Tuple[float, float]:
+        lon = float(np.interp(km, self._cum_km, self._coords[:, 0]))
+        lat = float(np.interp(km, self._cum_km, self._coords[:, 1]))
+        return lon, lat
+
+    def _cut(self, start_km: float, end_km: float) -> LineString:
+        inner = (self._cum_km > start_km) & (self._cum_km < end_km)
+        coords = [self._point_at(start_km), *map(tuple, self._coords[inner]), self._point_at(end_km)]
+        return LineString(coords)
+
+    def parts_outside(self, gaps_km: List[Tuple[float, float]]) -> List[LineString]:
+        """The route minus the given (start_km, end_km) stretches, as route pieces."""
+        parts: List[LineString] = []
+        pos = 0.0
+        for start_km, end_km in sorted(gaps_km):
+            if start_km > pos:
+                parts.append(self._cut(pos, start_km))
+            pos = max(pos, end_km)
+        if pos < self.total_km:
+            parts.append(self._cut(pos, self.total_km))
+        return parts
+
+    def _cells(self, start_km: float, end_km: float) -> List[str]:
+        n = max(1, int(math.ceil((end_km - start_km) / DENSITY_SAMPLE_KM)))
+        kms = [start_km + (end_km - start_km) * (i + 0.5) / n for i in range(n)]
+        return list(dict.fromkeys(_cell_key(*self._point_at(km)) for km in kms))
+
+    # ---- sizing -----------------------------------------------------------
+
+    def _expected_per_km(self, region: dict) -> Optional[float]:
+        """Expected matching POIs per route km in a region, or None if unknown."""
+        densities = region.get("density", {})
+        if not all(pt in densities for pt in self._radii):
+            return None
+        return sum(densities[pt] * 2.0 * r for pt, r in self._radii.items())
+
+    def _next_length(self) -> float:
+        region = DENSITY_STORE.get(_cell_key(*self._point_at(self._pos_km))) or {}
+        per_km = self._expected_per_km(region)
+        length = TARGET_ELEMENTS / per_km if per_km else None
+        if "max_km" in region:
+            length = min(length or math.inf, region["max_km"])
+        if self._last_km:
+            if self._last_slow:
+                length = min(length or self._last_km, self._last_km / 2)
+            else:
+                length = min(length or math.inf, self._last_km * MAX_GROWTH)
+        return min(max(length or DEFAULT_SEGMENT_KM, MIN_SEGMENT_KM), MAX_SEGMENT_KM)
+
+    def _remember(self, *boundaries_km: float) -> None:
+        self._plan = sorted(set(self._plan).union(boundaries_km))
+        PLAN_STORE.put(self._plan_key, self._plan)
+
+    def _snap(self, km: float) -> float:
+        return max(round(km / SEGMENT_GRID_KM), 1) * SEGMENT_GRID_KM
+
+    def next_segment(self) -> Optional[Tuple[float, float, LineString]]:
+        """Return (start_km, end_km, segment) for the next query, or None when done."""
+        if self._splits:
+            start_km, end_km = self._splits.popleft()
+            return start_km, end_km, self._cut(start_km, end_km)
+        if self._pos_km >= self.total_km:
+            return None
+        start_km = self._pos_km
+        replay = [km for km in self._plan if start_km < km <= self.total_km]
+        if replay:
+            end_km = replay[0]  # where an earlier run of this route cut — its answer is cached
+        else:
+            end_km = self._snap(start_km + self._next_length())
+            if self.total_km - end_km < MIN_SEGMENT_KM:
+                end_km = self.total_km  # don't leave a sliver for a request of its own
+            self._remember(end_km)
+        self._pos_km = end_km
+        return start_km, end_km, self._cut(start_km, end_km)
+
+    # ---- feedback ---------------------------------------------------------
+
+    def report_ok(
+        self,
+        piece: Tuple[float, float, LineString],
+        counts: Dict[str, int],
+        request_s: float,
+        queried_km: Optional[float] = None,
+    ) -> None:
+        """
+        Record a successful query: POIs found per type and the request duration.
+        queried_km is the route length actually queried when part of the
+        segment was already covered (defaults to the whole segment).
+        """
+        start_km, end_km, _ = piece
+        length = max(end_km - start_km, 0.1)
+        self._last_km = length
+        self._last_slow = request_s > SLOW_REQUEST_S
+        area_km = max(queried_km if queried_km is not None else length, 0.1)
+        observed = {pt: counts.get(pt, 0) / (area_km * 2.0 * max(r, 0.01)) for pt, r in self._radii.items()}
+        for cell in self._cells(start_km, end_km):
+            region = DENSITY_STORE.get(cell) or {}
+            densities = region.setdefault("density", {})
+            for pt, density in observed.items():
+                old = densities.get(pt)
+                densities[pt] = density if old is None else old + DENSITY_SMOOTHING * (density - old)
+            if not self._last_slow and region.get("max_km", math.inf) <= length:
+                region["max_km"] = length * CEILING_GROWTH
+            DENSITY_STORE.put(cell, region)
+
+    def report_too_large(self, piece: Tuple[float, float, LineString], learn: bool = True) -> bool:
+        """
+        Queue both halves of a segment whose query timed out or hit maxsize.
+        Returns False if it is already at MIN_SEGMENT_KM and cannot be split.
+
+        learn: lower the region's segment ceiling in DENSITY_STORE — only for a
+        server-side verdict on the query, not for a client timeout, which may
+        just as well be the network.  The split itself is always remembered,
+        so a replay hits the halves' cached answers.
+        """
+        start_km, end_km, _ = piece
+        if end_km - start_km < 2 * MIN_SEGMENT_KM:
+            return False
+        mid_km = min(max(self._snap((start_km + end_km) / 2), start_km + MIN_SEGMENT_KM), end_km - MIN_SEGMENT_KM)
+        self._splits.extendleft([(mid_km, end_km), (start_km, mid_km)])
+        self._remember(mid_km)
+        if learn:
+            for cell in self._cells(start_km, end_km):
+                region = DENSITY_STORE.get(cell) or {}
+                region["max_km"] = min(region.get("max_km", math.inf), mid_km - start_km)
+                DENSITY_STORE.put(cell, region)
+        self._last_km = mid_km - start_km
+        self._last_slow = True
+        logger.info(f"Segment km {start_km:.0f}–{end_km:.0f} too large — splitting at km {mid_km:.0f}")
+        return True
+
+
+class RouteCoverage:
+    """
+    Route parts already queried, for skipping repeated stretches of a route.
+
+    A part is only added once its query succeeded, and queries use radii padded
+    by OVERLAP_PAD_KM, so everything within a requested radius of a covered
+    stretch is already in an earlier answer.  Routes of similar earlier
+    searches (core/result_store.py) are added the same way.
+    """
+
+    def __init__(self):
+        self._lines: List[BaseGeometry] = []
+
+    def add(self, geom: BaseGeometry) -> None:
+        if not geom.is_empty:
+            self._lines.append(geom)
+
+    def _split(self, segment: LineString) -> Tuple[LocalProjection, BaseGeometry, Optional[BaseGeometry]]:
+        """(projection, segment in km, covered area in km or None if nothing is near)."""
+        proj = LocalProjection.for_geometry(segment)
+        metric = proj.forward(segment)
+        pad_deg = OVERLAP_PAD_KM / (111.0 * max(math.cos(math.radians(proj.lat0)), 0.01))
+        min_lon, min_lat, max_lon, max_lat = segment.bounds
+        window = box(min_lon - pad_deg, min_lat - pad_deg, max_lon + pad_deg, max_lat + pad_deg)
+        nearby = [line.intersection(window) for line in self._lines if line.intersects(window)]
+        if not nearby:
+            return proj, metric, None
+        return proj, metric, unary_union([proj.forward(g) for g in nearby]).buffer(OVERLAP_PAD_KM)
+
+    @staticmethod
+    def _route_parts(proj: LocalProjection, metric_parts: BaseGeometry) -> Tuple[BaseGeometry, float]:
+        rest = [
+            part for part in shapely.get_parts(metric_parts)
+            if part.geom_type == "LineString" and part.length >= MIN_UNCOVERED_KM
+        ]
+        if not rest:
+            return MultiLineString(), 0.0
+        merged = shapely.line_merge(MultiLineString(rest))
+        return proj.inverse(merged), float(merged.length)
+
+    def uncovered(self, segment: LineString) -> Tuple[BaseGeometry, float]:
+        """
+        Return (part of segment still to query, its length in km).  The part is
+        a LineString or MultiLineString, or an empty geometry when the whole
+        segment lies along route already queried.
+        """
+        proj, metric, covered = self._split(segment)
+        if covered is None:
+            return segment, float(metric.length)
+        return self._route_parts(proj, metric.difference(covered))
+
+    def covered(self, segment: LineString) -> Tuple[BaseGeometry, float]:
+        """Return (part of segment along route already queried, its length in km)."""
+        proj, metric, covered = self._split(segment)
+        if covered is None:
+            return MultiLineString(), 0.0
+        return self._route_parts(proj, metric.intersection(covered))
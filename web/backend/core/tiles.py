@@ -0,0 +1,101 @@
+"""
+Slippy-map tile helpers and the per-tile POI store.
+
+POIs are fetched from Overpass per (place type, tile) and kept on disk, so two
+different GPX files through the same valley share the same tiles.  Results are
+filtered against the exact route corridor locally after loading.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import math
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from shapely.geometry import box
+from shapely.geometry.base import BaseGeometry
+
+from .cache import CACHE_DIR, SqliteCache
+
+# z12 tiles are ~9.8 km wide at the equator (~6 km at 50°N): small enough that a
+# city tile stays well under Overpass limits, large enough to be reused often.
+TILE_ZOOM = 12
+TILE_STORE_TTL_S = 30 * 24 * 3600
+TILE_STORE_MAX_BYTES = 300 * 1024 * 1024
+TILE_STORE = SqliteCache(CACHE_DIR / "tiles.sqlite", TILE_STORE_TTL_S, TILE_STORE_MAX_BYTES)
+
+Tile = Tuple[int, int]  # (x, y) at TILE_ZOOM
+
+
+def lonlat_to_tile(lon: float, lat: float, zoom: int = TILE_ZOOM) -> Tile:
+    """Return the (x, y) slippy-map tile containing a point."""
+    n = 2 ** zoom
+    lat = max(min(lat, 85.0511), -85.0511)
+    x = int((lon + 180.0) / 360.0 * n)
+    lat_rad = math.radians(lat)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bounds(tile: Tile, zoom: int = TILE_ZOOM) -> Tuple[float, float, float, float]:
+    """Return (south, west, north, east) of a tile in degrees."""
+    x, y = tile
+    n = 2 ** zoom
+
+    def _lat(yy: int) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * yy / n))))
+
+    return _lat(y + 1), x / n * 360.0 - 180.0, _lat(y), (x + 1) / n * 360.0 - 180.0
+
+
+def corridor_tiles(segment: BaseGeometry, buffer_km: float, zoom: int = TILE_ZOOM) -> Set[Tile]:
+    """Tiles intersecting the segment buffered by buffer_km."""
+    lat0 = segment.centroid.y
+    # Buffer by the longitude-scaled degree radius — slightly generous in latitude
+    buffer_deg = buffer_km / (111.0 * max(math.cos(math.radians(lat0)), 0.01))
+    corridor = segment.buffer(buffer_deg)
+    min_lon, min_lat, max_lon, max_lat = corridor.bounds
+    x0, y0 = lonlat_to_tile(min_lon, max_lat, zoom)
+    x1, y1 = lonlat_to_tile(max_lon, min_lat, zoom)
+
+    tiles: Set[Tile] = set()
+    for x in range(x0, x1 + 1):
+        for y in range(y0, y1 + 1):
+            s, w, n, e = tile_bounds((x, y), zoom)
+            if corridor.intersects(box(w, s, e, n)):
+                tiles.add((x, y))
+    return tiles
+
+
+def _tile_key(place_type: str, pt_config: dict, tile: Tile) -> str:
+    # The query text is part of the key so editing PLACE_TYPE_CONFIG invalidates old tiles
+    qhash = hashlib.sha1(pt_config["query"].encode("utf-8")).hexdigest()[:8]
+    return f"{place_type}:{qhash}:{TILE_ZOOM}/{tile[0]}/{tile[1]}"
+
+
+def load_tile(place_type: str, pt_config: dict, tile: Tile) -> Optional[Tuple[List[dict], float]]:
+    """Return (stored elements, fetch time) for a (type, tile), or None if not fetched yet."""
+    return TILE_STORE.get_entry(_tile_key(place_type, pt_config, tile))
+
+
+def has_tile(place_type: str, pt_config: dict, tile: Tile) -> bool:
+    return TILE_STORE.contains(_tile_key(place_type, pt_config, tile))
+
+
+def store_tile(place_type: str, pt_config: dict, tile: Tile, elements: Iterable[dict]) -> None:
+    """Store a tile's elements, keeping only coordinates, name and the classifying tag."""
+    tag_key = pt_config.get("tag_key", "")
+    compact = []
+    for el in elements:
+        tags = el.get("tags", {})
+        kept = {k: tags[k] for k in ("name", tag_key) if k in tags}
+        compact.append({"lat": el["lat"], "lon": el["lon"], "tags": kept})
+    TILE_STORE.put(_tile_key(place_type, pt_config, tile), compact)
+
+
+def group_by_tile(elements: Iterable[dict]) -> Dict[Tile, List[dict]]:
+    """Bucket elements with lat/lon by the tile that contains them."""
+    buckets: Dict[Tile, List[dict]] = {}
+    for el in elements:
+        buckets.setdefault(lonlat_to_tile(el["lon"], el["lat"]), []).append(el)
+    return buckets
@@ -1,17 +1,25 @@
 """
 Valhalla routing — used for motorcycle/offroad profiles not available in OSRM.
 Public instance: https://valhalla1.openstreetmap.de
+
+Successful routes are kept in the persistent routing cache (core/routing_cache.py).
 """
 from __future__ import annotations
 
+import json
 import logging
+import os
 from typing import List, Optional, Tuple
 
 import requests
 
+from . import http_client
+from .routing_cache import ROUTING_CACHE, routing_key
+
 logger = logging.getLogger(__name__)
 
-VALHALLA_BASE = "https://valhalla1.openstreetmap.de"
+# TRACKWISE_VALHALLA_URL points at another Valhalla server, e.g. a local one or a test stand-in
+VALHALLA_BASE = os.environ.get("TRACKWISE_VALHALLA_URL", "https://valhalla1.openstreetmap.de").rstrip("/")
 
 RoutePoint = Tuple[float, float]  # (longitude, latitude)
 
@@ -74,8 +82,14 @@ def get_valhalla_route(
         "units": "km",
     }
 
+    # The costing options change the answer, so they are part of the key
+    cache_key = routing_key("valhalla", profile, waypoints, json.dumps(payload["costing_options"], sort_keys=True))
+    cached = ROUTING_CACHE.get(cache_key)
+    if cached is not None:
+        return [tuple(coord) for coord in cached]
+
     try:
-        r = requests.post(
+        r = http_client.post(
             f"{VALHALLA_BASE}/route",
             json=payload,
             timeout=15,
@@ -85,7 +99,9 @@ def get_valhalla_route(
 
         shape = data["trip"]["legs"][0]["shape"]
         decoded = _decode_polyline6(shape)  # [(lat, lon), ...]
-        return [(lon, lat) for lat, lon in decoded]   # [(lon, lat), ...]
+        route = [(lon, lat) for lat, lon in decoded]   # [(lon, lat), ...]
+        ROUTING_CACHE.put(cache_key, route)
+        return route
 
     except requests.exceptions.ConnectionError:
         logger.warning("Valhalla connection error")
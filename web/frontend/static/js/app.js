@@ -14,8 +14,10 @@ function trackwise() {
   let _routeLayer     = null;
   let _markerLayers   = {};   // {place_id: L.Marker}
   let _roadLayers     = {};   // {place_id: L.Polyline}
+  let _routesRequested = new Set();   // place ids whose detour geometry is loaded or loading
   let _gpxTrackLayer  = null;
   let _gpxWptLayers   = [];
+  const ROUTES_PER_REQUEST = 25;   // detour routes fetched per /routes call, drawn as each arrives
   // Custom waypoints: markers stored here, not in reactive customWaypoints array
   let _mapClickHandler       = null;
   let _customWpMarkers       = {};  // {id: L.Marker}
@@ -31,6 +33,9 @@ function trackwise() {
     gpxMode: 'track_with_waypoints',
 
     jobId: null,
+    subscriber: null,
+    resultJobId: null,    // finished search that a config change can refine
+    resultFile: null,
     searching: false,
     progress: 0,
     log: [],
@@ -200,11 +205,15 @@ function trackwise() {
       if (!this.gpxFile) { this.showToast('Select a GPX file first', 'error'); return; }
       if (Object.keys(this.searchConfig).length === 0) { this.showToast('Enable at least one place type', 'error'); return; }
 
+      // Same file as the finished search: refine it instead of searching from scratch
+      const refineFrom = this.resultJobId && this.resultFile === this.gpxFile ? this.resultJobId : null;
+
       this.searching = true;
       this.progress = 0;
       this.log = [];
       this.places = [];
       this.road_routes = {};
+      _routesRequested = new Set();
       this.route_points = [];
       this.clearMap();
 
@@ -213,13 +222,26 @@ function trackwise() {
       form.append('config', JSON.stringify(this.searchConfig));
 
       try {
-        const res = await fetch('/api/search', { method: 'POST', body: form });
+        let res = null;
+        if (refineFrom) {
+          res = await fetch(`/api/search/${refineFrom}/refine`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ config: this.searchConfig }),
+          });
+        }
+        if (!res || res.status === 404 || res.status === 409) {
+          // No refinable search (none yet, or it expired on the server) — full search
+          res = await fetch('/api/search', { method: 'POST', body: form });
+        }
         if (!res.ok) {
           const err = await res.json();
           throw new Error(err.detail || 'Server error');
         }
-        const { job_id } = await res.json();
+        const { job_id, subscriber, coalesced } = await res.json();
         this.jobId = job_id;
+        this.subscriber = subscriber;
+        if (coalesced) this.log.push('Identical search already running — following its progress');
         this.listenToJob(job_id);
       } catch (e) {
         this.searching = false;
@@ -228,7 +250,8 @@ function trackwise() {
     },
 
     listenToJob(jobId) {
-      const es = new EventSource(`/api/search/${jobId}/stream`);
+      const es = new EventSource(`/api/search/${jobId}/stream?subscriber=${this.subscriber}`);
+      this._eventSource = es;
 
       es.onmessage = (e) => {
         const event = JSON.parse(e.data);
@@ -243,11 +266,14 @@ function trackwise() {
 
         } else if (event.type === 'result') {
           this.places = event.places;
-          this.road_routes = event.road_routes;
+          this.road_routes = {};  // detour geometry is loaded as places are highlighted or ticked
+          _routesRequested = new Set();
           this.route_points = event.route_points;
           this.total_km = event.total_km;
           this.searching = false;
           this.progress = 100;
+          this.resultJobId = jobId;
+          this.resultFile = this.gpxFile;
           es.close();
           this.renderMap();
           this.showToast(`Found ${event.places.length} places along ${event.total_km.toFixed(1)} km route`, 'success');
@@ -276,7 +302,14 @@ function trackwise() {
 
     async cancelSearch() {
       if (!this.jobId) return;
-      await fetch(`/api/search/${this.jobId}/cancel`, { method: 'POST' });
+      const res = await fetch(`/api/search/${this.jobId}/cancel?subscriber=${this.subscriber}`, { method: 'POST' });
+      const { status } = await res.json();
+      if (status === 'detached') {
+        // Shared with an identical search that keeps running — just stop following it
+        this.searching = false;
+        if (this._eventSource) this._eventSource.close();
+        this.showToast('Search cancelled', 'info');
+      }
     },
 
     // ---- Map rendering ----
@@ -305,25 +338,66 @@ function trackwise() {
         });
         const marker = L.marker([place.lat, place.lon], { icon })
           .addTo(_map)
-          .bindPopup(`<b>${place.emoji} ${place.base_name}</b><br>Type: ${place.type_label}<br>Distance from route: ${place.distance_km} km`)
+          .bindPopup(`<b>${place.emoji} ${place.base_name}</b><br>Type: ${place.type_label}<br>Distance from route: ${place.distance_km} km`
+            + (place.detour_min != null ? `<br>Detour: ${place.detour_km} km / ${Math.round(place.detour_min)} min` : ''))
           .bindTooltip(place.base_name);
 
         marker.on('click', () => this.highlightPlace(place));
         _markerLayers[place.id] = marker;
       });
 
-      Object.entries(this.road_routes).forEach(([pid, route]) => {
-        if (!route || route.length < 2) return;
-        const place = this.places.find(p => p.id === pid);
-        const color = place ? place.color : 'gray';
-        const coords = route.map(([lon, lat]) => [lat, lon]);
-        _roadLayers[pid] = L.polyline(coords, { color, weight: 2, opacity: 0.55, dashArray: '4 4' }).addTo(_map);
-      });
+      Object.entries(this.road_routes).forEach(([pid, route]) => this.drawRoadRoute(pid, route));
 
       const boundsLayer = _routeLayer || _gpxTrackLayer;
       if (boundsLayer) _map.fitBounds(boundsLayer.getBounds().pad(0.1));
     },
 
+    drawRoadRoute(pid, route) {
+      if (!route || route.length < 2 || _roadLayers[pid]) return;
+      const place = this.places.find(p => p.id === pid);
+      const color = place ? place.color : 'gray';
+      const coords = route.map(([lon, lat]) => [lat, lon]);
+      _roadLayers[pid] = L.polyline(coords, {
+        color, weight: 2, opacity: place && !place.included ? 0.15 : 0.55, dashArray: '4 4',
+      }).addTo(_map);
+    },
+
+    // Detour geometry is fetched on demand, for the places the user highlights
+    // or ticks once the results are shown
+    async loadRoadRoutes(placeIds) {
+      const jobId = this.resultJobId;
+      let queue = placeIds.filter(pid => !_routesRequested.has(pid));
+      if (!jobId || !queue.length) return;
+      queue.forEach(pid => _routesRequested.add(pid));
+      while (queue.length) {
+        // Re-checked before every request: places unticked meanwhile are dropped
+        const wanted = new Set(this.places.filter(p => p.included || p.id === this.highlightedId).map(p => p.id));
+        queue.filter(pid => !wanted.has(pid)).forEach(pid => _routesRequested.delete(pid));
+        queue = queue.filter(pid => wanted.has(pid));
+        const chunk = queue.splice(0, ROUTES_PER_REQUEST);
+        if (!chunk.length) return;
+        try {
+          const res = await fetch(`/api/search/${jobId}/routes`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ place_ids: chunk }),
+          });
+          if (jobId !== this.resultJobId) return;
+          if (!res.ok) { chunk.forEach(pid => _routesRequested.delete(pid)); continue; }
+          const { road_routes } = await res.json();
+          this.road_routes = { ...this.road_routes, ...road_routes };
+          Object.entries(road_routes).forEach(([pid, route]) => this.drawRoadRoute(pid, route));
+        } catch (e) {
+          // Geometry is a nice-to-have — the place itself is already on the map
+          if (jobId === this.resultJobId) chunk.forEach(pid => _routesRequested.delete(pid));
+        }
+      }
+    },
+
+    loadSelectedRoadRoutes() {
+      this.loadRoadRoutes(this.selectedPlaces.map(p => p.id));
+    },
+
     updateMarkerOpacity() {
       this.places.forEach(place => {
         const marker = _markerLayers[place.id];
@@ -340,6 +414,7 @@ function trackwise() {
     togglePlace(place) {
       place.included = !place.included;
       this.updateMarkerOpacity();
+      if (place.included) this.loadRoadRoutes([place.id]);
     },
 
     highlightPlace(place) {
@@ -349,9 +424,10 @@ function trackwise() {
         _map.setView([place.lat, place.lon], Math.max(_map.getZoom(), 14));
         marker.openPopup();
       }
+      this.loadRoadRoutes([place.id]);
     },
 
-    selectAll()  { this.places.forEach(p => p.included = true);  this.updateMarkerOpacity(); },
+    selectAll()  { this.places.forEach(p => p.included = true);  this.updateMarkerOpacity(); this.loadSelectedRoadRoutes(); },
     selectNone() { this.places.forEach(p => p.included = false); this.updateMarkerOpacity(); },
 
     // ---- Sorting / filtering ----
@@ -377,8 +453,9 @@ function trackwise() {
       const key = this.sortKey;
       const asc = this.sortAsc ? 1 : -1;
       return [...list].sort((a, b) => {
-        if (a[key] < b[key]) return -1 * asc;
-        if (a[key] > b[key]) return  1 * asc;
+        const av = a[key] ?? Infinity, bv = b[key] ?? Infinity;  // unknown detours last
+        if (av < bv) return -1 * asc;
+        if (av > bv) return  1 * asc;
         return 0;
       });
     },